@@ -1,6 +1,140 @@
+import re
+import json
+import heapq
+import shutil
+import struct
+import argparse
 import duckdb
-from tinydb import TinyDB
+import msgpack
+import numpy as np
+import pyarrow as pa
+from tinydb import TinyDB, JSONStorage, Storage
+from tinydb.table import Document
+from tinydb.middlewares import CachingMiddleware
 import os
+from collections import defaultdict
+from datetime import date
+
+# MessagePack extension types: a single date as a day number, and a map of
+# records sharing the same scalar fields stored column by column
+DATE_EXT_TYPE = 1
+RECORDS_EXT_TYPE = 2
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def date_ordinal(value):
+    """Day number of a 'YYYY-MM-DD' string that reads back identically, else None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return None
+    return day.toordinal() if day.isoformat() == value else None
+
+
+def encode_key(key) -> str:
+    """Map key as JSONStorage stores it: strings unchanged, other scalars as their JSON text."""
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def encode_records(records: dict, fields: tuple) -> msgpack.ExtType:
+    """Store a map of records as its keys, its field names and one column per field."""
+    columns = []
+    for field in fields:
+        column = [record[field] for record in records.values()]
+        if field == "date":
+            ordinals = [date_ordinal(value) for value in column]
+            if None not in ordinals:
+                # Date columns become a packed array of int32 day numbers
+                column = np.array(ordinals, dtype="<i4").tobytes()
+        columns.append(column)
+    keys = [encode_key(key) for key in records]
+    return msgpack.ExtType(RECORDS_EXT_TYPE, msgpack.packb([keys, list(fields), columns]))
+
+
+def encode_document(value):
+    """Copy of a document ready for MessagePack, with dates and record maps encoded."""
+    if not isinstance(value, dict):
+        return value
+
+    records = list(value.values())
+    if records and all(isinstance(record, dict) for record in records):
+        fields = tuple(records[0])
+        # Records without fields have no column to carry their keys
+        if fields and all(tuple(record) == fields and all(isinstance(item, SCALAR_TYPES) for item in record.values())
+               for record in records):
+            return encode_records(value, fields)
+
+    encoded = {}
+    for key, item in value.items():
+        ordinal = date_ordinal(item) if key == "date" else None
+        if ordinal is not None:
+            encoded[encode_key(key)] = msgpack.ExtType(DATE_EXT_TYPE, struct.pack("<i", ordinal))
+        else:
+            encoded[encode_key(key)] = encode_document(item)
+    return encoded
+
+
+def decode_ext(code: int, data: bytes):
+    if code == DATE_EXT_TYPE:
+        return date.fromordinal(struct.unpack("<i", data)[0]).isoformat()
+
+    if code == RECORDS_EXT_TYPE:
+        keys, fields, columns = msgpack.unpackb(data, ext_hook=decode_ext)
+        for i, column in enumerate(columns):
+            if isinstance(column, bytes):
+                # Format each distinct day once
+                days, inverse = np.unique(np.frombuffer(column, dtype="<i4"), return_inverse=True)
+                day_strings = [date.fromordinal(day).isoformat() for day in days.tolist()]
+                columns[i] = [day_strings[index] for index in inverse.tolist()]
+        return dict(zip(keys, (dict(zip(fields, row)) for row in zip(*columns))))
+
+    return msgpack.ExtType(code, data)
+
+
+class BinaryStorage(Storage):
+    """
+    Store the data in a MessagePack file. Maps of records sharing the same
+    fields (TinyDB tables, product sales) are stored column by column so
+    field names are written once, and "YYYY-MM-DD" dates are stored as 4-byte
+    day numbers. As with JSONStorage, map keys are read back as strings and
+    every other value as written.
+    """
+
+    def __init__(self, path: str, access_mode: str = "rb+"):
+        super().__init__()
+        if "+" in access_mode and not os.path.exists(path):
+            open(path, "wb").close()
+        self._handle = open(path, mode=access_mode)
+
+    def close(self) -> None:
+        self._handle.close()
+
+    def read(self):
+        self._handle.seek(0)
+        content = self._handle.read()
+        if not content:
+            return None
+        return msgpack.unpackb(content, ext_hook=decode_ext)
+
+    def write(self, data):
+        self._handle.seek(0)
+        self._handle.write(msgpack.packb(encode_document(data)))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
+
+
+# TinyDB storages selectable from the command line, with their file extension
+STORAGES = {
+    "json": (JSONStorage, ".json"),
+    "binary": (BinaryStorage, ".msgpack"),
+}
+
+
+def open_tinydb(path: str, storage: str = "json", **kwargs) -> TinyDB:
+    return TinyDB(path, storage=STORAGES[storage][0], **kwargs)
 
 
 def convert_to_relational_json(database) -> {}:
@@ -17,6 +151,100 @@ def convert_to_relational_json(database) -> {}:
             "SaleDetails": sale_details.set_index('id').to_dict(orient='index')}
     return json
 
+
+# Same columns as convert_to_relational_json, with the dates formatted by DuckDB
+RELATIONAL_QUERIES = {
+    "Categories": "SELECT id, name, description FROM Categories",
+    "Products": "SELECT id, name, description, price, category_id FROM Products",
+    "Sales": "SELECT id, strftime(date, '%Y-%m-%d') AS date FROM Sales",
+    "SaleDetails": "SELECT id, sale_id, product_id, quantity FROM SaleDetails",
+}
+
+
+def fetch_record_batches(result, batch_size: int):
+    """Stream a result as Arrow record batches (to_arrow_reader in recent DuckDB, fetch_record_batch before)."""
+    if hasattr(result, "to_arrow_reader"):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+
+def convert_to_relational_json_arrow(database, batch_size: int = 100_000) -> {}:
+    """
+    Same document as convert_to_relational_json, without pandas: each table
+    is streamed from DuckDB as Arrow record batches, the dates are cast to
+    strings in one vectorized strftime, and the records are built straight
+    from the columns of each batch. The document itself is still a full copy
+    in Python objects: write_relational_json_arrow avoids it for JSON stores.
+    """
+    json = {}
+    for table_name, query in RELATIONAL_QUERIES.items():
+        records = {}
+        for batch in fetch_record_batches(database.execute(query), batch_size):
+            columns = batch.to_pydict()
+            ids = columns.pop("id")
+            fields = tuple(columns)
+            records.update(zip(ids, (dict(zip(fields, values)) for values in zip(*columns.values()))))
+        json[table_name] = records
+    return json
+
+
+# Each record of the relational store as JSON text, next to its id. Prices are
+# widened to DOUBLE first, so they print as the Python float of the FLOAT value
+RELATIONAL_JSON_QUERIES = {
+    "Categories": "SELECT id, to_json(struct_pack(name, description)) FROM Categories",
+    "Products": """
+    SELECT id, to_json(struct_pack(name, description, price := price::DOUBLE, category_id)) FROM Products
+    """,
+    "Sales": "SELECT id, to_json(struct_pack(date := strftime(date, '%Y-%m-%d'))) FROM Sales",
+    "SaleDetails": "SELECT id, to_json(struct_pack(sale_id, product_id, quantity)) FROM SaleDetails",
+}
+
+
+def write_relational_json_arrow(database, path: str, batch_size: int = 100_000):
+    """
+    Write the relational store as the JSON file TinyDB's JSONStorage reads,
+    without building the document in Python: DuckDB serializes every record,
+    and the (id, JSON text) Arrow record batches are written out one at a time,
+    so memory stays bounded by the batch size.
+    """
+    with open(path, "w") as file:
+        file.write("{")
+        for table_index, (table_name, query) in enumerate(RELATIONAL_JSON_QUERIES.items()):
+            file.write(f'{", " if table_index else ""}{json.dumps(table_name)}: {{')
+            separator = ""
+            for batch in fetch_record_batches(database.execute(query), batch_size):
+                ids, records = batch.column(0).to_pylist(), batch.column(1).to_pylist()
+                file.write(separator + ", ".join(f'"{record_id}": {record}' for record_id, record in zip(ids, records)))
+                separator = ", " if ids else separator
+            file.write("}")
+        file.write("}")
+
+
+def export_relational_arrow(database, directory: str, batch_size: int = 100_000):
+    """
+    Write each table of the relational store to an Arrow IPC file
+    (directory/<table>.arrow), batch by batch, ids included.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for table_name, query in RELATIONAL_QUERIES.items():
+        batches = fetch_record_batches(database.execute(query), batch_size)
+        with pa.OSFile(os.path.join(directory, f"{table_name}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, batches.schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+
+
+def read_relational_arrow(directory: str) -> {}:
+    """
+    Open the Arrow IPC files written by export_relational_arrow as tables
+    memory-mapped from disk: the column buffers are not copied until read.
+    """
+    return {
+        table_name: pa.ipc.open_file(pa.memory_map(os.path.join(directory, f"{table_name}.arrow"))).read_all()
+        for table_name in RELATIONAL_QUERIES
+    }
+
+
 def convert_to_hierarchical_json(database) -> {}:
     # Query DuckDB to fetch relational data
     categories = database.execute("SELECT id, name, description FROM Categories").fetchall()
@@ -24,39 +252,22 @@ def convert_to_hierarchical_json(database) -> {}:
     sales = database.execute("SELECT id, date FROM Sales").fetchall()
     sale_details = database.execute("SELECT sale_id, product_id, quantity FROM SaleDetails").fetchall()
 
-    # Transform data into hierarchical JSON structure
-    json = {"Categories": {}}
+    # Index rows by id once instead of scanning the lists for every product
+    category_names = {category_id: category_name for category_id, category_name, _ in categories}
+    sale_dates = dict(sales)
 
-    # Build categories
-    for category_id, category_name, category_description in categories:
-        json["Categories"][category_name] = {}
+    # Group sale details by product, keeping their original order
+    product_sales = defaultdict(list)
+    for sale_id, product_id, quantity in sale_details:
+        product_sales[product_id].append((sale_id, quantity, sale_dates[sale_id]))
 
-    # Build products under each category
-    for product_id, product_name, product_description, product_price, category_id in products:
-        # Find category name for this product
-        category_name = next(cat[1] for cat in categories if cat[0] == category_id)
-        json["Categories"][category_name][product_name] = {
-            "description": product_description,
-            "price": product_price,
-            "sales": {}
-        }
+    # Transform data into hierarchical JSON structure
+    json = {"Categories": {category_name: {} for category_name in category_names.values()}}
 
-    # Add sales to products, sorted by date
+    # Add products under each category, with their sales sorted by date
     for product_id, product_name, product_description, product_price, category_id in products:
-        # Find the category name
-        category_name = next(cat[1] for cat in categories if cat[0] == category_id)
-
-        # Filter and sort sale details for this product
-        product_sales = [
-            (sale_id, quantity, next(sale[1] for sale in sales if sale[0] == sale_id))
-            for sale_id, prod_id, quantity in sale_details
-            if prod_id == product_id
-        ]
-        # Sort by sale date
-        product_sales.sort(key=lambda x: x[2])
-
-        # Add sorted sales to the product
-        json["Categories"][category_name][product_name] = {
+        sorted_sales = sorted(product_sales[product_id], key=lambda x: x[2])
+        json["Categories"][category_names[category_id]][product_name] = {
             "description": product_description,
             "price": product_price,
             "sales": {
@@ -65,49 +276,550 @@ def convert_to_hierarchical_json(database) -> {}:
                     "date": sale_date.strftime("%Y-%m-%d"),
                     "quantity": quantity,
                 }
-                for idx, (sale_id, quantity, sale_date) in enumerate(product_sales)
+                for idx, (sale_id, quantity, sale_date) in enumerate(sorted_sales)
             },
         }
 
     return json
 
 
+def convert_to_hierarchical_json_duckdb(database) -> {}:
+    """
+    Same document as convert_to_hierarchical_json, but the joins, the date
+    sort and the grouping of sales by product all run inside DuckDB: each
+    product comes back with its sales already serialized as a JSON list.
+    """
+    rows = database.execute("""
+    SELECT
+      cat.name AS category
+      , pr.name AS name
+      , pr.description AS description
+      , pr.price AS price
+      , COALESCE(
+          to_json(list(struct_pack(
+              ticket := sd.sale_id
+              , date := strftime(sl.date, '%Y-%m-%d')
+              , quantity := sd.quantity
+          ) ORDER BY sl.date, sd.rowid) FILTER (WHERE sd.id IS NOT NULL))
+          , '[]'
+        ) AS sales
+    FROM Categories cat
+    LEFT JOIN Products pr ON pr.category_id = cat.id
+    LEFT JOIN SaleDetails sd ON sd.product_id = pr.id
+    LEFT JOIN Sales sl ON sd.sale_id = sl.id
+    GROUP BY cat.rowid, cat.name, pr.rowid, pr.name, pr.description, pr.price
+    ORDER BY cat.rowid, pr.rowid
+    """).fetchall()
+
+    json_data = {"Categories": {}}
+    for category_name, product_name, product_description, product_price, product_sales in rows:
+        category = json_data["Categories"].setdefault(category_name, {})
+        if product_name is None:  # Category without products
+            continue
+        category[product_name] = {
+            "description": product_description,
+            "price": product_price,
+            "sales": dict(enumerate(json.loads(product_sales), start=1)),
+        }
+
+    return json_data
+
+
+def new_totals() -> {}:
+    return {"quantity": 0, "revenue": 0.0, "months": {}}
+
+
+def add_to_totals(totals: {}, sale_date: str, quantity: int, revenue: float):
+    """Add a sale to rolled-up totals, or remove it with a negative quantity and revenue."""
+    totals["quantity"] += quantity
+    totals["revenue"] += revenue
+    month = totals["months"].setdefault(sale_date[:7], {"quantity": 0, "revenue": 0.0})
+    month["quantity"] += quantity
+    month["revenue"] += revenue
+    if month["quantity"] == 0:
+        del totals["months"][sale_date[:7]]
+
+
+def add_rollups(json: {}) -> {}:
+    """
+    Embed precomputed totals in a hierarchical document: a "totals" entry in
+    each product and a "CategoryTotals" map, each with the quantity, the
+    revenue and per-month ("YYYY-MM") buckets of the sales below it.
+    """
+    category_totals = {}
+    for category_name, products in json["Categories"].items():
+        for product_name, product_data in products.items():
+            product_totals = new_totals()
+            for sale in product_data["sales"].values():
+                add_to_totals(product_totals, sale["date"], sale["quantity"], product_data["price"] * sale["quantity"])
+            product_data["totals"] = product_totals
+
+            totals = category_totals.setdefault(category_name, new_totals())
+            totals["quantity"] += product_totals["quantity"]
+            totals["revenue"] += product_totals["revenue"]
+            for month_name, month in product_totals["months"].items():
+                category_month = totals["months"].setdefault(month_name, {"quantity": 0, "revenue": 0.0})
+                category_month["quantity"] += month["quantity"]
+                category_month["revenue"] += month["revenue"]
+
+    json["CategoryTotals"] = category_totals
+    return json
+
+
+def export_hierarchical_ndjson(database, path: str, batch_size: int = 100_000):
+    """
+    Stream the hierarchical store to an NDJSON file, one product per line:
+    {"category", "product", "description", "price", "sales"}, with the same
+    1-based "sales" map as convert_to_hierarchical_json. Categories without
+    products get a {"category"} line of their own, so the export holds the
+    same categories as the document. Sale details are read in batches
+    already ordered by product and date, so only the sales of the current
+    product are held in memory.
+    """
+    products = database.execute("""
+    SELECT pr.id, cat.name, pr.name, pr.description, pr.price
+    FROM Products pr
+    FULL JOIN Categories cat ON pr.category_id = cat.id
+    ORDER BY pr.id NULLS LAST, cat.id
+    """).fetchall()
+
+    sales = database.execute("""
+    SELECT sd.product_id, sd.sale_id, strftime(sl.date, '%Y-%m-%d'), sd.quantity
+    FROM SaleDetails sd
+    JOIN Sales sl ON sd.sale_id = sl.id
+    ORDER BY sd.product_id, sl.date, sd.rowid
+    """)
+
+    def sale_batches():
+        while batch := sales.fetchmany(batch_size):
+            yield from batch
+
+    sale_rows = sale_batches()
+    pending = next(sale_rows, None)
+
+    with open(path, "w") as file:
+        for product_id, category_name, product_name, product_description, product_price in products:
+            if product_id is None:  # Category without products
+                file.write(json.dumps({"category": category_name}) + "\n")
+                continue
+
+            # Skip sales of unknown products, then collect this product's sales
+            while pending is not None and pending[0] < product_id:
+                pending = next(sale_rows, None)
+            product_sales = {}
+            while pending is not None and pending[0] == product_id:
+                _, sale_id, sale_date, quantity = pending
+                product_sales[len(product_sales) + 1] = {"ticket": sale_id, "date": sale_date, "quantity": quantity}
+                pending = next(sale_rows, None)
+
+            file.write(json.dumps({
+                "category": category_name,
+                "product": product_name,
+                "description": product_description,
+                "price": product_price,
+                "sales": product_sales,
+            }) + "\n")
+
+
+def write_hierarchical_partitions(json_data: {}, directory: str, storage: str = "json"):
+    """
+    Write a hierarchical document as one TinyDB store per category and month
+    (directory/<category>/<YYYY-MM>, the category name reduced to letters,
+    digits and underscores, with a numeric suffix when two names reduce to
+    the same directory), each holding that month's sales in the
+    same nested shape, numbered from 1 again, plus a manifest.json with the
+    storage, every product's description and price, and for each partition
+    its category, month, file, products and number of sales.
+    """
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    extension = STORAGES[storage][1]
+    manifest = {"storage": storage, "categories": {}, "partitions": []}
+    # Compared case-insensitively, for case-insensitive file systems
+    category_directories = set()
+
+    for category_name, products in json_data["Categories"].items():
+        manifest["categories"][category_name] = {
+            product_name: {"description": product_data["description"], "price": product_data["price"]}
+            for product_name, product_data in products.items()
+        }
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", category_name).strip("_") or "category"
+        category_directory, suffix = slug, 1
+        while category_directory.lower() in category_directories:
+            suffix += 1
+            category_directory = f"{slug}_{suffix}"
+        category_directories.add(category_directory.lower())
+        os.makedirs(os.path.join(directory, category_directory), exist_ok=True)
+
+        # month -> product name -> sales, still in date order
+        months = defaultdict(lambda: defaultdict(list))
+        for product_name, product_data in products.items():
+            for sale in product_data["sales"].values():
+                months[sale["date"][:7]][product_name].append(sale)
+
+        for month in sorted(months):
+            path = os.path.join(category_directory, f"{month}{extension}")
+            month_products = {
+                product_name: {
+                    "description": products[product_name]["description"],
+                    "price": products[product_name]["price"],
+                    "sales": dict(enumerate(sales, start=1)),
+                }
+                for product_name, sales in months[month].items()
+            }
+            partition = open_tinydb(os.path.join(directory, path), storage)
+            partition.insert({"Categories": {category_name: month_products}})
+            partition.close()
+            manifest["partitions"].append({
+                "category": category_name,
+                "month": month,
+                "path": path,
+                "products": list(month_products),
+                "sales": sum(len(product["sales"]) for product in month_products.values()),
+            })
+
+    # Written last: readers notice a new layout from the manifest
+    with open(os.path.join(directory, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+
+def write_relational_tinydb(relational_data: {}, path: str, mode: str = "bulk", storage: str = "json"):
+    """
+    Write the relational store into TinyDB, keeping the DuckDB ids as doc ids.
+    - insert: one insert per record, each one rewriting the whole JSON file
+    - bulk: one insert_multiple per table behind a write cache flushed once per table
+    - direct: the whole document written to the storage at once
+    """
+    storage_cls = STORAGES[storage][0]
+
+    if mode == "direct":
+        tinydb = TinyDB(path, storage=storage_cls)
+        tinydb.storage.write({
+            table_name: {str(record_id): record_value for record_id, record_value in records.items()}
+            for table_name, records in relational_data.items()
+        })
+        tinydb.close()
+        return
+
+    if mode == "bulk":
+        tinydb = TinyDB(path, storage=CachingMiddleware(storage_cls))
+    else:
+        tinydb = TinyDB(path, storage=storage_cls)
+
+    for table_name, records in relational_data.items():
+        # Get or create the TinyDB table
+        tmp_table = tinydb.table(table_name)
+
+        if mode == "bulk":
+            # Insert all records at once, then write the table to disk
+            tmp_table.insert_multiple(
+                Document(record_value, doc_id=record_id) for record_id, record_value in records.items()
+            )
+            tinydb.storage.flush()
+        else:
+            # Insert records one by one, with explicit id
+            for record_id, record_value in records.items():
+                tmp_table.insert(Document(record_value, doc_id=record_id))
+
+    tinydb.close()
+
+
+def high_water_mark(database) -> {}:
+    """Highest id of each table of the database, -1 for an empty table."""
+    category_id, product_id, sale_id, sale_detail_id = database.execute("""
+    SELECT
+      (SELECT COALESCE(MAX(id), -1) FROM Categories)
+      , (SELECT COALESCE(MAX(id), -1) FROM Products)
+      , (SELECT COALESCE(MAX(id), -1) FROM Sales)
+      , (SELECT COALESCE(MAX(id), -1) FROM SaleDetails)
+    """).fetchone()
+    return {"category_id": category_id, "product_id": product_id, "sale_id": sale_id, "sale_detail_id": sale_detail_id}
+
+
+# Every column of each table, hashed per row to fingerprint the rows already synced
+FINGERPRINT_COLUMNS = {
+    "Categories": ("category_id", "id, name, description"),
+    "Products": ("product_id", "id, name, description, price, category_id"),
+    "Sales": ("sale_id", "id, date"),
+    "SaleDetails": ("sale_detail_id", "id, sale_id, product_id, quantity"),
+}
+
+
+def synced_rows_fingerprint(database, state: {}) -> int:
+    """
+    XOR of the hashes of every row at or below the high-water mark of its
+    table. It changes when the database is regenerated or a synced row is
+    modified or deleted, which an incremental sync cannot follow.
+    """
+    fingerprint = 0
+    for table_name, (mark, columns) in FINGERPRINT_COLUMNS.items():
+        fingerprint ^= database.execute(
+            f"SELECT COALESCE(bit_xor(hash({columns})), 0) FROM {table_name} WHERE id <= ?", [state[mark]]
+        ).fetchone()[0]
+    return fingerprint
+
+
+def sync_state(database) -> {}:
+    """High-water mark of the database, with the fingerprint of the rows below it."""
+    state = high_water_mark(database)
+    return {**state, "fingerprint": synced_rows_fingerprint(database, state)}
+
+
+def read_sync_state(path: str):
+    """
+    High-water mark of the last conversion or sync, or None if there was none
+    or it predates the marks of every table and the fingerprint.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        state = json.load(file)
+    return state if "fingerprint" in state else None
+
+
+def can_sync(database, state: {}) -> bool:
+    """
+    Whether the stores converted at this state can be brought up to date
+    incrementally: no mark went backwards and the rows below them are
+    unchanged. Otherwise only a full conversion gives the right stores.
+    """
+    marks = high_water_mark(database)
+    return (all(marks[mark] >= state[mark] for mark in marks)
+            and synced_rows_fingerprint(database, state) == state["fingerprint"])
+
+
+def write_sync_state(path: str, state: {}):
+    with open(path, "w") as file:
+        json.dump(state, file)
+
+
+def convert_relational_delta(database, state: {}, new_state: {}) -> {}:
+    """Rows of every table between two high-water marks, in the format of convert_to_relational_json."""
+    categories = database.execute(
+        "SELECT id, name, description FROM Categories WHERE id > ? AND id <= ? ORDER BY id",
+        [state["category_id"], new_state["category_id"]]).fetchall()
+    products = database.execute(
+        "SELECT id, name, description, price, category_id FROM Products WHERE id > ? AND id <= ? ORDER BY id",
+        [state["product_id"], new_state["product_id"]]).fetchall()
+    sales = database.execute(
+        "SELECT id, strftime(date, '%Y-%m-%d') FROM Sales WHERE id > ? AND id <= ? ORDER BY id",
+        [state["sale_id"], new_state["sale_id"]]).fetchall()
+    sale_details = database.execute(
+        "SELECT id, sale_id, product_id, quantity FROM SaleDetails WHERE id > ? AND id <= ? ORDER BY id",
+        [state["sale_detail_id"], new_state["sale_detail_id"]]).fetchall()
+
+    return {
+        "Categories": {
+            category_id: {"name": name, "description": description} for category_id, name, description in categories
+        },
+        "Products": {
+            product_id: {"name": name, "description": description, "price": price, "category_id": category_id}
+            for product_id, name, description, price, category_id in products
+        },
+        "Sales": {sale_id: {"date": sale_date} for sale_id, sale_date in sales},
+        "SaleDetails": {
+            sale_detail_id: {"sale_id": sale_id, "product_id": product_id, "quantity": quantity}
+            for sale_detail_id, sale_id, product_id, quantity in sale_details
+        },
+    }
+
+
+def merge_hierarchical_delta(json: {}, database, state: {}, new_state: {}) -> int:
+    """
+    Merge the categories, products and sale details between two high-water
+    marks into a hierarchical document read from TinyDB, so the result is the
+    document a full conversion would give: new categories and products go
+    after the existing ones, each product's sales stay in date order, new
+    sales going after existing ones of the same date, and rollups are kept up
+    to date when the document has them. Sale keys are strings, as once stored.
+    Returns the number of merged sales.
+    """
+    has_rollups = "CategoryTotals" in json
+
+    # New categories, then new products, in id order as a full conversion adds them
+    for (category_name,) in database.execute(
+            "SELECT name FROM Categories WHERE id > ? AND id <= ? ORDER BY id",
+            [state["category_id"], new_state["category_id"]]).fetchall():
+        json["Categories"].setdefault(category_name, {})
+    for category_name, product_name, product_description, product_price in database.execute("""
+    SELECT cat.name, pr.name, pr.description, pr.price
+    FROM Products pr
+    JOIN Categories cat ON pr.category_id = cat.id
+    WHERE pr.id > ? AND pr.id <= ?
+    ORDER BY pr.id
+    """, [state["product_id"], new_state["product_id"]]).fetchall():
+        product = {"description": product_description, "price": product_price, "sales": {}}
+        if has_rollups:
+            product["totals"] = new_totals()
+            json["CategoryTotals"].setdefault(category_name, new_totals())
+        json["Categories"][category_name][product_name] = product
+
+    rows = database.execute("""
+    SELECT cat.name, pr.name, sd.sale_id, strftime(sl.date, '%Y-%m-%d'), sd.quantity
+    FROM SaleDetails sd
+    JOIN Sales sl ON sd.sale_id = sl.id
+    JOIN Products pr ON sd.product_id = pr.id
+    JOIN Categories cat ON pr.category_id = cat.id
+    WHERE sd.id > ? AND sd.id <= ?
+    ORDER BY sl.date, sd.rowid
+    """, [state["sale_detail_id"], new_state["sale_detail_id"]]).fetchall()
+
+    # Group the new sales by product, already in date order
+    new_sales = defaultdict(list)
+    for category_name, product_name, sale_id, sale_date, quantity in rows:
+        product = json["Categories"][category_name][product_name]
+        new_sales[(category_name, product_name)].append({"ticket": sale_id, "date": sale_date, "quantity": quantity})
+        if has_rollups:
+            revenue = product["price"] * quantity
+            add_to_totals(product["totals"], sale_date, quantity, revenue)
+            add_to_totals(json["CategoryTotals"][category_name], sale_date, quantity, revenue)
+
+    for (category_name, product_name), product_new_sales in new_sales.items():
+        product = json["Categories"][category_name][product_name]
+        sales = list(product["sales"].values())
+        if not sales or sales[-1]["date"] <= product_new_sales[0]["date"]:
+            # Usual case, only later sales: append after the existing keys
+            for sale in product_new_sales:
+                product["sales"][str(len(product["sales"]) + 1)] = sale
+        else:
+            # Back-dated sales: merge both ordered lists and renumber from 1
+            merged = heapq.merge(sales, product_new_sales, key=lambda sale: sale["date"])
+            product["sales"] = {str(idx + 1): sale for idx, sale in enumerate(merged)}
+
+    return len(rows)
+
+
+def sync_tinydb(database, hierarchical_path: str, relational_path: str, state: {}, storage: str = "json",
+                partitions_path: str = None) -> {}:
+    """
+    Bring both TinyDB stores up to date with the rows of every table added to
+    DuckDB since the high-water mark, as a full conversion would write them,
+    and return the new mark. DuckDB only reads and converts the new rows;
+    each store file is still read and rewritten once. Rows added while
+    syncing are left for the next sync. Partitions already written to
+    partitions_path are rewritten from the synced document.
+    """
+    new_state = sync_state(database)
+
+    # Hierarchical store: one document, read once through the write cache
+    hierarchical_tinydb = TinyDB(hierarchical_path, storage=CachingMiddleware(STORAGES[storage][0]))
+    document = hierarchical_tinydb.all()[0]
+    merge_hierarchical_delta(document, database, state, new_state)
+    hierarchical_tinydb.update(document, doc_ids=[document.doc_id])
+    hierarchical_tinydb.close()
+    if partitions_path and os.path.exists(partitions_path):
+        write_hierarchical_partitions(document, partitions_path, storage)
+
+    # Relational store: the new rows inserted with their DuckDB ids
+    write_relational_tinydb(convert_relational_delta(database, state, new_state), relational_path, "bulk", storage)
+
+    return new_state
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert the DuckDB shop database into TinyDB stores.")
+    parser.add_argument("--engine", choices=["python", "duckdb"], default="python",
+                        help="Build the hierarchical document in Python or inside DuckDB")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="Stream the hierarchical store to NDJSON instead of a single TinyDB document")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Embed per-product and per-category totals in the hierarchical document")
+    parser.add_argument("--relational-mode", choices=["insert", "bulk", "direct"], default="bulk",
+                        help="How the relational store is written to TinyDB")
+    parser.add_argument("--relational-engine", choices=["pandas", "arrow"], default="pandas",
+                        help="Build the relational store through pandas DataFrames or Arrow record batches. "
+                             "With JSON storage, Arrow streams the records straight to the file (direct mode)")
+    parser.add_argument("--arrow-ipc", action="store_true",
+                        help="Also export the relational store as memory-mappable Arrow IPC files")
+    parser.add_argument("--storage", choices=list(STORAGES), default="json",
+                        help="TinyDB storage backend of the hierarchical and relational stores")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only add the rows newer than the last run to the existing stores "
+                             "(existing partitions are rewritten from the synced document)")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="Also write the hierarchical store partitioned by category and month")
+    args = parser.parse_args()
+    if args.incremental and args.ndjson:
+        parser.error("--incremental only applies to the TinyDB stores, not to the NDJSON export")
+    if args.partitioned and (args.ndjson or args.incremental):
+        parser.error("--partitioned rewrites the partitions from the full hierarchical document")
+    return args
+
+
 def main():
+    args = parse_args()
+
     # Paths
+    extension = STORAGES[args.storage][1]
     duckdb_path = "data/duckdb_shop.db"
-    hierarchical_tinydb_path = "data/hierarchical_tinydb_shop.json"
-    relational_tinydb_path = "data/relational_tinydb_shop.json"
+    hierarchical_tinydb_path = f"data/hierarchical_tinydb_shop{extension}"
+    hierarchical_ndjson_path = "data/hierarchical_shop.ndjson"
+    relational_tinydb_path = f"data/relational_tinydb_shop{extension}"
+    hierarchical_partitions_path = "data/hierarchical_partitions"
+    relational_arrow_path = "data/relational_arrow"
+    sync_state_path = f"data/tinydb_sync_state_{args.storage}.json"
+
+    # Incremental sync, when both stores were converted before from the same rows
+    state = read_sync_state(sync_state_path)
+    if (args.incremental and state is not None
+            and os.path.exists(hierarchical_tinydb_path) and os.path.exists(relational_tinydb_path)):
+        con = duckdb.connect(duckdb_path, read_only=True)
+        if can_sync(con, state):
+            state = sync_tinydb(con, hierarchical_tinydb_path, relational_tinydb_path, state, args.storage,
+                                hierarchical_partitions_path)
+            con.close()
+            write_sync_state(sync_state_path, state)
+            return
+        con.close()
+        print("The database changed below the last high-water mark: converting everything again")
 
     # Reset TinyDB
-    if os.path.exists(hierarchical_tinydb_path):
-        os.remove(hierarchical_tinydb_path)
-    if os.path.exists(relational_tinydb_path):
-        os.remove(relational_tinydb_path)
+    for path in (hierarchical_tinydb_path, hierarchical_ndjson_path, relational_tinydb_path, sync_state_path):
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(hierarchical_partitions_path):
+        shutil.rmtree(hierarchical_partitions_path)
 
-    # Connect to DuckDB
+    # Connect to DuckDB, reading everything from the same transaction as the high-water mark
     con = duckdb.connect(duckdb_path)
-    hierarchical_tinydb = TinyDB(hierarchical_tinydb_path)
-    relational_tinydb = TinyDB(relational_tinydb_path)
+    con.begin()
 
-    # Convert
-    hierarchical_data = convert_to_hierarchical_json(con)
-    relational_data = convert_to_relational_json(con)
+    # Convert the hierarchical store
+    if args.ndjson:
+        export_hierarchical_ndjson(con, hierarchical_ndjson_path)
+    else:
+        if args.engine == "duckdb":
+            hierarchical_data = convert_to_hierarchical_json_duckdb(con)
+        else:
+            hierarchical_data = convert_to_hierarchical_json(con)
+        if args.rollups:
+            add_rollups(hierarchical_data)
+        hierarchical_tinydb = open_tinydb(hierarchical_tinydb_path, args.storage)
+        hierarchical_tinydb.insert(hierarchical_data)
+        hierarchical_tinydb.close()
+        if args.partitioned:
+            write_hierarchical_partitions(hierarchical_data, hierarchical_partitions_path, args.storage)
 
-    # Insert into TinyDB
-    hierarchical_tinydb.insert(hierarchical_data)
-    for table_name, records in relational_data.items():
-        # Get or create the TinyDB table
-        tmp_table = relational_tinydb.table(table_name)
+    # Convert the relational store
+    if args.relational_engine == "arrow" and args.storage == "json":
+        write_relational_json_arrow(con, relational_tinydb_path)
+    else:
+        if args.relational_engine == "arrow":
+            relational_data = convert_to_relational_json_arrow(con)
+        else:
+            relational_data = convert_to_relational_json(con)
+        write_relational_tinydb(relational_data, relational_tinydb_path, args.relational_mode, args.storage)
+
+    if args.arrow_ipc:
+        export_relational_arrow(con, relational_arrow_path)
 
-        # Insert records into the table
-        for record_id, record_value in records.items():
-            # Insert with explicit id and unpack the rest of the fields
-            tmp_table.insert({**record_value})
+    # High-water mark for the next incremental sync
+    if not args.ndjson:
+        write_sync_state(sync_state_path, sync_state(con))
 
-    # Close connections
+    # Close connection
+    con.commit()
     con.close()
-    hierarchical_tinydb.close()
-    relational_tinydb.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,16 @@
+import re
+import time
+import argparse
+import threading
+import statistics
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import duckdb
 
-if __name__ == "__main__":
-    # Connect
-    con = duckdb.connect("data/duckdb_shop.db")
-
+# Named queries: filters are $name parameters, so every variation has the same SQL text
+QUERIES = {
     # Query to get total sales by category
-    query = """
+    "category_sales": """
     SELECT
        SUM(sd.quantity) AS total_quantity
        , cat.name AS category
@@ -13,13 +18,10 @@ if __name__ == "__main__":
     LEFT JOIN Products pr ON sd.product_id = pr.id
     LEFT JOIN Categories cat ON pr.category_id = cat.id
     GROUP BY category
-    """
-    print("Get total sales by categories:")
-    results = con.sql(query)
-    print(results)
+    """,
 
     # Query to get total price for each items
-    query = """
+    "product_prices": """
     SELECT
         pd.name AS name
         , pd.price AS unit_price
@@ -29,13 +31,10 @@ if __name__ == "__main__":
     LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
     GROUP BY name, pd.price
     ORDER BY total_earned DESC
-    """
-    print("Get total prices for each items:")
-    results = con.sql(query)
-    print(results)
+    """,
 
     # Query to get all sales of a given date
-    query = """
+    "daily_sales": """
     SELECT
       cat.name AS category
       , pd.name AS name
@@ -47,15 +46,12 @@ if __name__ == "__main__":
     LEFT JOIN Products pd ON (cat.id = pd.category_id)
     LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
     LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
-    WHERE sl.date = '2024-08-10'
+    WHERE sl.date = $date
     ORDER BY category, total_price DESC
-    """
-    print("Get all sales for a given date: '2024-08-10'")
-    results = con.sql(query)
-    print(results)
+    """,
 
-    # Query to get all sales of a given product during August
-    query = """
+    # Query to get all sales of a given product during a period
+    "product_monthly": """
         SELECT
           pd.name AS name
           , pd.price AS unit_price
@@ -65,15 +61,12 @@ if __name__ == "__main__":
         FROM Products pd
         LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
         LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
-        WHERE pd.name = 'Laptop' AND sl.date >= '2024-08-01' AND sl.date <= '2024-08-31'
+        WHERE pd.name = $product AND sl.date >= $first_day AND sl.date <= $last_day
         ORDER BY date, total_price DESC
-        """
-    print("Get all sales of Laptop during '2024-08'")
-    results = con.sql(query)
-    print(results)
+        """,
 
     # Query to count all sales for each product or categories
-    query = """
+    "rollup_summary": """
     SELECT
       cat.name AS Category
       , pd.name AS Product
@@ -83,13 +76,10 @@ if __name__ == "__main__":
     LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
     GROUP BY ROLLUP (Category, Product)
     ORDER BY Category, Quantity DESC
-    """
-    print("Get the count of quantities sold for each product or categories (ROLLUP method):")
-    results = con.sql(query)
-    print(results)
+    """,
 
     # Query to count all sales for each product or categories during the year
-    query = """
+    "union_summary": """
         SELECT
           cat.name AS Type
           , COALESCE(SUM(sd.quantity), 0) AS Quantity
@@ -97,9 +87,9 @@ if __name__ == "__main__":
         LEFT JOIN Products pd ON cat.id = pd.category_id
         LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
         GROUP BY Type
-        
+
         UNION
-        
+
         SELECT
           pd.name AS Type
           , COALESCE(SUM(sd.quantity), 0) AS Quantity
@@ -107,10 +97,352 @@ if __name__ == "__main__":
         LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
         GROUP BY Type
         ORDER BY Quantity DESC, Type
-        """
-    print("Get the count of quantities sold for each product or categories during the year (UNION method):")
-    results = con.sql(query)
-    print(results)
+        """,
+
+    # Batched daily sales: every date of a list answered by one join against the unnested list
+    "daily_sales_batch": """
+    SELECT
+      lookup.date AS date
+      , cat.name AS category
+      , pd.name AS name
+      , pd.price AS unit_price
+      , sd.quantity AS quantity
+      , pd.price * sd.quantity AS total_price
+    FROM (SELECT DISTINCT UNNEST($dates::DATE[]) AS date) lookup
+    JOIN Sales sl ON (sl.date = lookup.date)
+    JOIN SaleDetails sd ON (sd.sale_id = sl.id)
+    JOIN Products pd ON (pd.id = sd.product_id)
+    JOIN Categories cat ON (cat.id = pd.category_id)
+    ORDER BY date, category, total_price DESC
+    """,
+
+    # Batched product sales: every product of a list during the same period, in one scan
+    "product_monthly_batch": """
+        SELECT
+          pd.name AS name
+          , pd.price AS unit_price
+          , sd.quantity AS quantity
+          , pd.price * sd.quantity AS total_price
+          , sl.date AS date
+        FROM (SELECT DISTINCT UNNEST($products::VARCHAR[]) AS name) lookup
+        JOIN Products pd ON (pd.name = lookup.name)
+        JOIN SaleDetails sd ON (pd.id = sd.product_id)
+        JOIN Sales sl ON (sd.sale_id = sl.id)
+        WHERE sl.date >= $first_day AND sl.date <= $last_day
+        ORDER BY name, date, total_price DESC
+        """,
+}
+
+# Reports printed by this script: title and parameters of their query
+REPORTS = {
+    "category_sales": ("Get total sales by categories:", {}),
+    "product_prices": ("Get total prices for each items:", {}),
+    "daily_sales": ("Get all sales for a given date: '{date}'", {"date": "2024-08-10"}),
+    "product_monthly": ("Get all sales of {product} from '{first_day}' to '{last_day}'",
+                        {"product": "Laptop", "first_day": "2024-08-01", "last_day": "2024-08-31"}),
+    "rollup_summary": ("Get the count of quantities sold for each product or categories (ROLLUP method):", {}),
+    "union_summary": ("Get the count of quantities sold for each product or categories during the year "
+                      "(UNION method):", {}),
+}
+
+
+def fetch_arrow(result):
+    """Fetch the result as an Arrow table (to_arrow_table in recent DuckDB, fetch_arrow_table before)."""
+    if hasattr(result, "to_arrow_table"):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+class NamedQueries:
+    """
+    Named queries run on a connection with their $name parameters bound by
+    DuckDB as typed values, so a value is never spliced into the SQL text.
+    """
+
+    def __init__(self, con, queries: dict = QUERIES):
+        self.con = con
+        self.queries = queries
+
+    def execute(self, name: str, **params):
+        return self.con.execute(self.queries[name], params)
+
+
+def daily_sales(statements: NamedQueries, target_date):
+    """Sales of one date."""
+    return fetch_arrow(statements.execute("daily_sales", date=target_date))
+
+
+def daily_sales_batch(statements: NamedQueries, dates: list):
+    """Sales of every date of a list in one query, with the date as first column."""
+    return fetch_arrow(statements.execute("daily_sales_batch", dates=list(dates)))
+
+
+def product_sales_between(statements: NamedQueries, product: str, first_day, last_day):
+    """Sales of one product between two dates, both included."""
+    return fetch_arrow(statements.execute("product_monthly", product=product, first_day=first_day, last_day=last_day))
+
+
+def product_sales_between_batch(statements: NamedQueries, products: list, first_day, last_day):
+    """Sales of every product of a list between two dates in one query."""
+    return fetch_arrow(statements.execute("product_monthly_batch", products=list(products),
+                                          first_day=first_day, last_day=last_day))
+
+
+def params_key(params) -> tuple:
+    """Hashable form of positional or named parameters."""
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    return tuple(tuple(value) if isinstance(value, list) else value for value in params)
+
+
+# Quoted strings and identifiers, with their doubled quotes, or a run of whitespace outside them
+SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Collapse whitespace outside quoted strings and identifiers and drop the
+    trailing semicolon, so layout changes do not miss the cache while
+    literals that differ only in their spaces stay different queries.
+    """
+    return SQL_TOKENS.sub(lambda match: match.group(1) or " ", query).strip().rstrip(";").rstrip()
+
+
+def referenced_tables(query: str) -> frozenset:
+    """Tables a query reads from, as named after FROM and JOIN."""
+    return frozenset(re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", query, flags=re.IGNORECASE))
+
+
+def table_versions(con) -> dict:
+    """
+    Current version of each table, bumped by the fill paths and optimize_layout
+    of 01_SQL_init. Writes made any other way, such as ad-hoc SQL or another
+    client, are not seen by the cache unless followed by
+    01_SQL_init.bump_table_versions for the tables they changed.
+    """
+    try:
+        return dict(con.execute("SELECT name, version FROM TableVersions").fetchall())
+    except duckdb.CatalogException:
+        # Database created before table versions existed: it is never written again
+        return {}
+
+
+class QueryCache:
+    """
+    Query results as Arrow tables, keyed by normalized SQL text and parameters.
+    An entry is served while the tables it reads keep the version they had
+    when it was computed. The least recently used entries are evicted beyond
+    max_entries results or max_bytes of Arrow buffers. The cache can be shared
+    by threads: queries run outside its lock.
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 64 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def execute(self, con, query: str, params=()):
+        """Result of the query as an Arrow table, from the cache when none of its tables changed."""
+        normalized = normalize_sql(query)
+        key = (normalized, params_key(params))
+        versions = table_versions(con)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                table, entry_versions = entry
+                if all(versions.get(name) == version for name, version in entry_versions.items()):
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return table
+                self.invalidations += 1
+                self.discard(key)
+            self.misses += 1
+
+        table = fetch_arrow(con.execute(query, params))
+        entry_versions = {name: versions.get(name) for name in referenced_tables(normalized)}
+        with self.lock:
+            self.store(key, table, entry_versions)
+        return table
+
+    def store(self, key, table, entry_versions: dict):
+        if table.nbytes > self.max_bytes:
+            return
+        # Another thread may have stored the same result meanwhile
+        self.discard(key)
+        self.entries[key] = (table, entry_versions)
+        self.nbytes += table.nbytes
+        while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[0].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+        }
+
+
+def run_report(statements: NamedQueries, name: str, params: dict = None, cache: QueryCache = None):
+    """
+    Result of a report as an Arrow table, with its default parameters unless
+    others are given. Served through the cache when one is given.
+    """
+    params = REPORTS[name][1] if params is None else params
+    if cache is not None:
+        return cache.execute(statements.con, QUERIES[name], params)
+    return fetch_arrow(statements.execute(name, **params))
+
+
+def run_reports_concurrently(con, names=tuple(REPORTS), workers: int = None, cache: QueryCache = None) -> dict:
+    """
+    Run independent reports on a thread pool, each on its own cursor of the
+    connection, and return their results in the order of names.
+    """
+    def run_on_cursor(name: str):
+        cursor = con.cursor()
+        try:
+            return run_report(NamedQueries(cursor), name, cache=cache)
+        finally:
+            cursor.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(names, executor.map(run_on_cursor, names)))
+
+
+def generate_load(con, num_clients: int, duration: float, names=tuple(REPORTS)) -> dict:
+    """
+    Have num_clients threads replay the report mix on their own cursor for
+    duration seconds, and return the throughput and latency percentiles.
+    """
+    deadline = time.perf_counter() + duration
+    latencies = [[] for _ in range(num_clients)]
+
+    def client(index: int):
+        cursor = con.cursor()
+        statements = NamedQueries(cursor)
+        # Clients start at different reports, so they do not all run the same one at once
+        position = index
+        while time.perf_counter() < deadline:
+            name = names[position % len(names)]
+            start_time = time.perf_counter()
+            run_report(statements, name)
+            latencies[index].append(time.perf_counter() - start_time)
+            position += 1
+        cursor.close()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_clients) as executor:
+        list(executor.map(client, range(num_clients)))
+    elapsed = time.perf_counter() - start_time
+
+    all_latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    if len(all_latencies) > 1:
+        quantiles = statistics.quantiles(all_latencies, n=100, method="inclusive")
+    else:
+        # No query or a single one finished before the deadline: no percentiles, or all the same
+        quantiles = (all_latencies or [None]) * 99
+    return {
+        "clients": num_clients,
+        "queries": len(all_latencies),
+        "qps": len(all_latencies) / elapsed,
+        "p50": quantiles[49],
+        "p95": quantiles[94],
+        "p99": quantiles[98],
+    }
+
+
+def print_load(threads: int, load: dict):
+    if not load["queries"]:
+        print(f"threads={threads:<3} clients={load['clients']:<3} no query finished")
+        return
+    print(f"threads={threads:<3} clients={load['clients']:<3} {load['qps']:9.1f} queries/s  "
+          f"p50 {load['p50'] * 1000:8.2f} ms  p95 {load['p95'] * 1000:8.2f} ms  p99 {load['p99'] * 1000:8.2f} ms")
+
+
+def print_report(con, name: str, table, params: dict = None):
+    title, default_params = REPORTS[name]
+    print(title.format(**(default_params if params is None else params)))
+    print(con.from_arrow(table))
+
+
+def print_cache_stats(stats: dict):
+    print("Result cache:")
+    print(f"  Hits: {stats['hits']}, Misses: {stats['misses']} ({stats['hit_rate']:.0%} hit rate)")
+    print(f"  Invalidations: {stats['invalidations']}, Evictions: {stats['evictions']}")
+    print(f"  Entries: {stats['entries']} ({stats['bytes'] / 1024:.1f} KiB)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print the SQL reports of the DuckDB shop database.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Serve the reports from a result cache while their tables are unchanged")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Print every report this many times, as a dashboard refreshing would")
+    parser.add_argument("--concurrent", type=int, metavar="WORKERS",
+                        help="Run the reports concurrently on this many threads, each with its own cursor")
+    parser.add_argument("--load", type=int, nargs="+", metavar="CLIENTS",
+                        help="Replay the report mix with each number of client threads and report QPS and latency")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Seconds each load level lasts")
+    parser.add_argument("--threads", type=int, nargs="+",
+                        help="DuckDB threads settings to repeat the load with (intra-query parallelism)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Connect
+    con = duckdb.connect("data/duckdb_shop.db")
+    statements = NamedQueries(con)
+    cache = QueryCache() if args.cache else None
+
+    if args.load:
+        # Load generator: every DuckDB threads setting against every number of clients
+        for threads in args.threads or [con.execute("SELECT current_setting('threads')").fetchone()[0]]:
+            con.execute(f"SET threads = {int(threads)}")
+            for num_clients in args.load:
+                print_load(threads, generate_load(con, num_clients, args.duration))
+        con.close()
+        return
+
+    for _ in range(args.repeat):
+        if args.concurrent:
+            for name, table in run_reports_concurrently(con, workers=args.concurrent, cache=cache).items():
+                print_report(con, name, table)
+            continue
+        for name in REPORTS:
+            print_report(con, name, run_report(statements, name, cache=cache))
+
+    if cache is not None:
+        print_cache_stats(cache.stats())
 
     # Close
-    con.close()
\ No newline at end of file
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,150 @@
+import os
+import json
+import shutil
+import fcntl
+import tempfile
+import weakref
+import threading
+import argparse
+import importlib
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
 from collections import defaultdict
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from datetime import date
+
+nosql_init = importlib.import_module("02_NoSQL_init")
+
+
+class NDJSONStore:
+    """
+    Read-only hierarchical store exported by 02_NoSQL_init --ndjson, one
+    product per line. Products are parsed lazily, one line at a time, and
+    the lines of categories without products are skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def iter_products(self):
+        with open(self.path) as file:
+            for line in file:
+                product = json.loads(line)
+                if 'product' in product:
+                    yield product['category'], product['product'], product
+
+    def close(self):
+        pass
+
+
+class PartitionedStore:
+    """
+    Read-only hierarchical store written by 02_NoSQL_init --partitioned, one
+    TinyDB file per category and month listed in a manifest. Date queries
+    only open the partitions of their months and products, and aggregations
+    compute a partial result per partition in a process pool (workers=1
+    keeps them in this process), started on first use and shut down by
+    close(). Partitions read are kept while the snapshot cache is on, until
+    the manifest changes.
+    """
+
+    def __init__(self, directory: str, workers: int = None):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+        self.workers = workers
+        self.signature = None
+        self.manifest = None
+        self.documents = {}
+        self.quantities = None
+        self.executor = None
+
+    def current_manifest(self):
+        """Manifest of the store, re-read with an empty partition cache when the layout was rewritten."""
+        stat = os.stat(self.path)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if signature != self.signature:
+            with open(self.path) as file:
+                self.manifest = json.load(file)
+            self.signature = signature
+            self.documents = {}
+            self.quantities = None
+        return self.manifest
+
+    def partitions(self, first_month: str = None, last_month: str = None, product_name: str = None) -> list:
+        """Partitions that may hold sales of a product (or any) between two 'YYYY-MM' months, inclusive."""
+        return [
+            partition for partition in self.current_manifest()['partitions']
+            if (first_month is None or partition['month'] >= first_month)
+            and (last_month is None or partition['month'] <= last_month)
+            and (product_name is None or product_name in partition['products'])
+        ]
+
+    def read(self, partition) -> dict:
+        """Hierarchical document of one partition."""
+        document = self.documents.get(partition['path'])
+        if document is None:
+            db = nosql_init.open_tinydb(os.path.join(self.directory, partition['path']), self.manifest['storage'])
+            document = db.all()[0]
+            db.close()
+            if snapshot_cache_enabled:
+                self.documents[partition['path']] = document
+        return document
+
+    def iter_products(self):
+        """Yield (category name, product name, product data) with the sales of every month merged back."""
+        manifest = self.current_manifest()
+        product_sales = defaultdict(list)
+        # The partitions of a category are listed by month, so the merged sales stay in date order
+        for partition in manifest['partitions']:
+            for category_name, product_name, product_data in document_products(self.read(partition)):
+                product_sales[(category_name, product_name)].extend(product_data['sales'].values())
+
+        for category_name, products in manifest['categories'].items():
+            for product_name, product in products.items():
+                sales = product_sales[(category_name, product_name)]
+                yield category_name, product_name, {**product, 'sales': dict(enumerate(sales, start=1))}
+
+    def product_quantities(self) -> dict:
+        """Total quantity per (category name, product name), merged from one partial sum per partition."""
+        manifest = self.current_manifest()
+        if self.quantities is not None:
+            return self.quantities
+
+        paths = [os.path.join(self.directory, partition['path']) for partition in manifest['partitions']]
+        storages = [manifest['storage']] * len(paths)
+        if self.workers == 1:
+            partials = list(map(partition_quantities, paths, storages))
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            partials = list(self.executor.map(partition_quantities, paths, storages))
+
+        quantities = defaultdict(int)
+        for partial in partials:
+            for product, quantity in partial.items():
+                quantities[product] += quantity
+        if snapshot_cache_enabled:
+            self.quantities = quantities
+        return quantities
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def partition_quantities(path: str, storage: str) -> dict:
+    """Quantity sold per (category name, product name) in one partition file, in a pool worker."""
+    db = nosql_init.open_tinydb(path, storage)
+    quantities = {
+        (category_name, product_name): sum(sale['quantity'] for sale in product_data['sales'].values())
+        for category_name, product_name, product_data in document_products(db.all()[0])
+    }
+    db.close()
+    return quantities
 
 
 def print_separator(title: str):
@@ -9,7 +153,563 @@ def print_separator(title: str):
     print("-" * len(title))
 
 
-def get_total_sales_by_category(db):
+def storage_path(db):
+    """Path of the file behind a TinyDB (through its middlewares) or an NDJSON store, if any."""
+    if isinstance(db, (NDJSONStore, SharedStore, PartitionedStore)):
+        return db.path
+
+    storage = db.storage
+    while not hasattr(storage, '_handle') and hasattr(storage, 'storage'):
+        storage = storage.storage
+    handle = getattr(storage, '_handle', None)
+    return handle.name if handle is not None else None
+
+
+def watch_writes(db):
+    """Count the writes made through a TinyDB, so changes are noticed even within the file mtime resolution."""
+    if isinstance(db, (NDJSONStore, SharedStore, PartitionedStore)) or hasattr(db.storage, 'write_count'):
+        return
+
+    storage = db.storage
+    write = storage.write
+
+    def counted_write(data):
+        write(data)
+        storage.write_count += 1
+
+    storage.write_count = 0
+    storage.write = counted_write
+
+
+def document_version(db):
+    """Signature of the store: writes seen through TinyDB, plus inode, size and mtime of its file."""
+    if isinstance(db, SharedStore):
+        return db.current().version
+    version = (getattr(getattr(db, 'storage', None), 'write_count', 0),)
+    path = storage_path(db)
+    if path is not None:
+        stat = os.stat(path)
+        version += (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    return version
+
+
+class Snapshot:
+    """
+    Read-only list of the (category name, product name, product data) of a
+    store, and its category rollups if any, at a given version.
+    """
+
+    def __init__(self, db):
+        watch_writes(db)
+        self.version = document_version(db)
+        if isinstance(db, (NDJSONStore, PartitionedStore)):
+            self.products = list(db.iter_products())
+            self.category_totals = None
+        else:
+            data = db.all()[0]
+            self.products = list(document_products(data))
+            self.category_totals = data.get('CategoryTotals')
+        # Derived from the products on first use, never changing what they hold
+        self.ordered_sales = {}
+
+    def product_ordered_sales(self, category_name: str, product_name: str, product_data):
+        """(day ordinals, sales) of a product in date order, cached for the lifetime of the snapshot."""
+        key = (category_name, product_name)
+        entry = self.ordered_sales.get(key)
+        if entry is None:
+            entry = self.ordered_sales[key] = ordered_sales(product_data)
+        return entry
+
+
+def durable_replace(temp_path: str, path: str):
+    """
+    Replace path with temp_path so that the new content survives a crash: the
+    data is flushed to disk before the rename, and the rename before returning.
+    """
+    with open(temp_path, "rb+") as file:
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class SharedStore:
+    """
+    Concurrency layer in front of a hierarchical TinyDB file, which TinyDB
+    itself does not make safe to share between threads or processes:
+    - readers share the current Snapshot, never modified once published
+    - writes are serialized by a thread lock and, across processes, by an
+      exclusive lock on {path}.lock (fcntl.flock, so POSIX only). Each is
+      applied to a private copy of the file, which atomically and durably
+      replaces the store (durable_replace) before the new snapshot is
+      published with the next generation number
+    Readers of the file elsewhere see either the old or the new content,
+    never a half-written one, and replacements made by another process are
+    noticed from the file signature and reloaded. The generation number is
+    kept in {path}.generation, so it keeps increasing across restarts and
+    a writer knows whether another process wrote since it last loaded.
+    """
+
+    def __init__(self, path: str, storage: str = "json"):
+        self.path = path
+        self.storage = storage
+        self.write_lock = threading.Lock()
+        self.generation = 0
+        self.signature = None
+        self.snapshot = None
+        with self.write_lock:
+            self.load()
+
+    def file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def read_generation(self) -> int:
+        """Generation number of the last write to the file, 0 before the first one."""
+        try:
+            with open(f"{self.path}.generation") as file:
+                return int(file.read())
+        except FileNotFoundError:
+            return 0
+
+    def write_generation(self, generation: int):
+        temp_path = f"{self.path}.generation.tmp"
+        with open(temp_path, "w") as file:
+            file.write(str(generation))
+        durable_replace(temp_path, f"{self.path}.generation")
+
+    def load(self):
+        signature = self.file_signature()
+        db = nosql_init.open_tinydb(self.path, self.storage)
+        snapshot = Snapshot(db)
+        db.close()
+        # Never going back, even when the generation file is not written yet
+        self.publish(snapshot, signature, max(self.read_generation(), self.generation + 1))
+
+    def publish(self, snapshot: Snapshot, signature, generation: int):
+        self.generation = generation
+        snapshot.version = (self.generation,)
+        self.signature = signature
+        # Swapping the reference last, readers only ever see complete snapshots
+        self.snapshot = snapshot
+
+    def current(self) -> Snapshot:
+        """Snapshot to read from, reloaded first if another process replaced the file."""
+        if self.file_signature() != self.signature:
+            with self.write_lock:
+                if self.file_signature() != self.signature:
+                    self.load()
+        return self.snapshot
+
+    def write(self, operation, *args):
+        """
+        Apply operation(db, *args), such as add_sale or remove_sale, to a
+        TinyDB copy of the store, then publish it. Returns what operation returns.
+        """
+        with self.write_lock, open(f"{self.path}.lock", "a") as lock_file:
+            # Held from the reload to the new generation, so writers of other processes wait
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Build on the latest content and generation, even if another process wrote them
+            if self.file_signature() != self.signature or self.read_generation() > self.generation:
+                self.load()
+            generation = max(self.read_generation(), self.generation) + 1
+            handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                                 prefix=f"{os.path.basename(self.path)}.", suffix=".tmp")
+            os.close(handle)
+            try:
+                # Also copies the permissions, which mkstemp restricts to the owner
+                shutil.copy(self.path, temp_path)
+                db = TinyDB(temp_path, storage=CachingMiddleware(nosql_init.STORAGES[self.storage][0]))
+                result = operation(db, *args)
+                snapshot = Snapshot(db)
+                db.close()
+                durable_replace(temp_path, self.path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self.write_generation(generation)
+            self.publish(snapshot, self.file_signature(), generation)
+            return result
+
+    def close(self):
+        pass
+
+
+# Snapshots shared by all analysis functions, one per store. Off by default:
+# the snapshot holds the parsed document itself, which callers must not modify
+_snapshots = weakref.WeakKeyDictionary()
+snapshot_cache_enabled = False
+
+
+def set_snapshot_cache(enabled: bool):
+    """
+    Turn the snapshot cache on (warm) or off (cold: every query re-reads the
+    store). With the cache on, the product data returned by iter_products is
+    shared by every query and must be treated as read-only.
+    """
+    global snapshot_cache_enabled
+    snapshot_cache_enabled = enabled
+    if not enabled:
+        _snapshots.clear()
+
+
+def refresh_snapshot(db) -> Snapshot:
+    """Re-read the store and replace its cached snapshot."""
+    if isinstance(db, SharedStore):
+        return db.current()
+    snapshot = Snapshot(db)
+    _snapshots[db] = snapshot
+    return snapshot
+
+
+def get_snapshot(db) -> Snapshot:
+    """Cached snapshot of a store, refreshed when the store changed since it was taken."""
+    if isinstance(db, SharedStore):
+        return db.current()
+    snapshot = _snapshots.get(db)
+    if snapshot is None or snapshot.version != document_version(db):
+        snapshot = refresh_snapshot(db)
+    return snapshot
+
+
+def document_products(data):
+    """Yield (category name, product name, product data) from a hierarchical document."""
+    for category_name, products in data['Categories'].items():
+        for product_name, product_data in products.items():
+            yield category_name, product_name, product_data
+
+
+def read_products(db):
+    """Read (category name, product name, product data) from a TinyDB document or an NDJSON store."""
+    if isinstance(db, SharedStore):
+        return iter(db.current().products)
+    if isinstance(db, (NDJSONStore, PartitionedStore)):
+        return db.iter_products()
+
+    # Get the first (and only) document in our TinyDB
+    return document_products(db.all()[0])
+
+
+def iter_products(db):
+    """Yield (category name, product name, product data), from the shared snapshot when the cache is on."""
+    if snapshot_cache_enabled:
+        return iter(get_snapshot(db).products)
+    return read_products(db)
+
+
+@lru_cache(maxsize=4096)
+def date_ordinal(sale_date: str) -> int:
+    """Day ordinal of a 'YYYY-MM-DD' date; the few hundred distinct dates are parsed once."""
+    return date.fromisoformat(sale_date).toordinal()
+
+
+def month_ordinals(year: int, month: int):
+    """First and last day ordinals of a month."""
+    return date(year, month, 1).toordinal(), date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+
+
+def ordered_sales(product_data):
+    """
+    (day ordinals, sales) of a product in date order. 02_NoSQL_init writes
+    the sales sorted by date and add_sale keeps them so, which makes this a
+    single pass; documents written otherwise are sorted here.
+    """
+    sales = list(product_data['sales'].values())
+    ordinals = [date_ordinal(sale['date']) for sale in sales]
+    if any(previous > current for previous, current in zip(ordinals, ordinals[1:])):
+        order = sorted(range(len(sales)), key=ordinals.__getitem__)
+        sales = [sales[position] for position in order]
+        ordinals = [ordinals[position] for position in order]
+    return ordinals, sales
+
+
+def product_ordered_sales(db, category_name: str, product_name: str, product_data):
+    """(day ordinals, sales) of a product, from the shared snapshot when the cache is on."""
+    if snapshot_cache_enabled or isinstance(db, SharedStore):
+        return get_snapshot(db).product_ordered_sales(category_name, product_name, product_data)
+    return ordered_sales(product_data)
+
+
+class SalesIndex:
+    """
+    Secondary indexes over the hierarchical document, built in one pass:
+    - products: product name -> [(category name, product data)]
+    - dates: date -> [(category name, product name, product data, sale)]
+    - product_dates: (category name, product name) -> (sorted day ordinals, sales in the same order)
+    """
+
+    def __init__(self, db):
+        self.products = defaultdict(list)
+        self.dates = defaultdict(list)
+        self.product_dates = {}
+
+        for category_name, product_name, product_data in iter_products(db):
+            self.products[product_name].append((category_name, product_data))
+            ordinals, sales = ordered_sales(product_data)
+            for sale in sales:
+                self.dates[sale['date']].append((category_name, product_name, product_data, sale))
+            self.product_dates[(category_name, product_name)] = (ordinals, sales)
+
+    def product_sales_between(self, category_name: str, product_name: str, first_day: int, last_day: int):
+        """Sales of a product with first_day <= day ordinal <= last_day, by binary search on its sorted days."""
+        ordinals, sales = self.product_dates[(category_name, product_name)]
+        return sales[bisect_left(ordinals, first_day):bisect_right(ordinals, last_day)]
+
+
+# Indexes enabled with enable_indexes, with the document version they were built from
+_indexes = weakref.WeakKeyDictionary()
+
+
+def enable_indexes(db) -> SalesIndex:
+    """Build the secondary indexes of a store; the query functions use them from now on."""
+    watch_writes(db)
+    # Version taken first: a write during the build only causes an extra rebuild
+    version = document_version(db)
+    index = SalesIndex(db)
+    _indexes[db] = (version, index)
+    return index
+
+
+def get_indexes(db):
+    """Indexes of a store, rebuilt if the document changed since they were built, or None if not enabled."""
+    entry = _indexes.get(db)
+    if entry is None:
+        return None
+    version, index = entry
+    if version != document_version(db):
+        index = enable_indexes(db)
+    return index
+
+
+class ColumnarSales:
+    """
+    Columnar copy of the hierarchical document: the sales of all products
+    concatenated into NumPy arrays (quantity, date as day number, ticket),
+    with offsets delimiting each product's sales and a price per product.
+    """
+
+    def __init__(self, db):
+        self.categories, self.names, prices = [], [], []
+        quantities, days, tickets, lengths = [], [], [], []
+        day_numbers = {}
+
+        for category_name, product_name, product_data in iter_products(db):
+            sales = product_data['sales'].values()
+            self.categories.append(category_name)
+            self.names.append(product_name)
+            prices.append(product_data['price'])
+            lengths.append(len(sales))
+            for sale in sales:
+                if sale['date'] not in day_numbers:
+                    day_numbers[sale['date']] = date.fromisoformat(sale['date']).toordinal()
+                days.append(day_numbers[sale['date']])
+                quantities.append(sale['quantity'])
+                tickets.append(sale['ticket'])
+
+        self.prices = np.array(prices, dtype=np.float64)
+        self.quantities = np.array(quantities, dtype=np.int64)
+        self.days = np.array(days, dtype=np.int32)
+        self.tickets = np.array(tickets, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+    def product_quantities(self) -> np.ndarray:
+        """Total quantity sold per product, one segment sum per product."""
+        lengths = np.diff(self.offsets)
+        if not len(self.quantities):
+            return np.zeros(len(lengths), dtype=np.int64)
+        # reduceat needs in-range starts and returns an element for empty segments
+        totals = np.add.reduceat(self.quantities, np.minimum(self.offsets[:-1], len(self.quantities) - 1))
+        totals[lengths == 0] = 0
+        return totals
+
+    def sales_on(self, day: int):
+        """Yield (category name, product name, unit price, quantity) of every sale on a day number."""
+        positions = np.flatnonzero(self.days == day)
+        products = np.searchsorted(self.offsets, positions, side='right') - 1
+        for position, product in zip(positions.tolist(), products.tolist()):
+            yield (self.categories[product], self.names[product],
+                   float(self.prices[product]), int(self.quantities[position]))
+
+    def sales_between(self, first_day: int, last_day: int, product_name: str = None):
+        """
+        Yield (category name, product name, unit price, quantity, day number) of
+        the sales with first_day <= day <= last_day, of one product or all of
+        them. Each product's days are in date order, so its range is found by
+        binary search; a product written out of order falls back to a mask.
+        """
+        for product, name in enumerate(self.names):
+            if product_name is not None and name != product_name:
+                continue
+            start, end = self.offsets[product], self.offsets[product + 1]
+            days, quantities = self.days[start:end], self.quantities[start:end]
+            if len(days) > 1 and (np.diff(days) < 0).any():
+                mask = (days >= first_day) & (days <= last_day)
+                days, quantities = days[mask], quantities[mask]
+            else:
+                first, last = np.searchsorted(days, [first_day, last_day + 1])
+                days, quantities = days[first:last], quantities[first:last]
+            for day, quantity in zip(days.tolist(), quantities.tolist()):
+                yield self.categories[product], name, float(self.prices[product]), quantity, day
+
+
+# Columnar views enabled with enable_columnar, with the document version they were built from
+_columnar = weakref.WeakKeyDictionary()
+
+
+def enable_columnar(db) -> ColumnarSales:
+    """Build the columnar view of a store; the query functions compute on it from now on."""
+    watch_writes(db)
+    version = document_version(db)
+    columnar = ColumnarSales(db)
+    _columnar[db] = (version, columnar)
+    return columnar
+
+
+def disable_columnar(db):
+    _columnar.pop(db, None)
+
+
+def get_columnar(db):
+    """Columnar view of a store, rebuilt if the document changed since it was built, or None if not enabled."""
+    entry = _columnar.get(db)
+    if entry is None:
+        return None
+    version, columnar = entry
+    if version != document_version(db):
+        columnar = enable_columnar(db)
+    return columnar
+
+
+def iter_product_totals(db):
+    """Yield (category name, product name, unit price, total quantity) per product."""
+    columnar = get_columnar(db)
+    if columnar is not None:
+        for product, quantity in enumerate(columnar.product_quantities().tolist()):
+            yield columnar.categories[product], columnar.names[product], float(columnar.prices[product]), quantity
+        return
+
+    if isinstance(db, PartitionedStore):
+        quantities = db.product_quantities()
+        for category_name, products in db.current_manifest()['categories'].items():
+            for product_name, product in products.items():
+                yield category_name, product_name, product['price'], quantities.get((category_name, product_name), 0)
+        return
+
+    for category_name, product_name, product_data in iter_products(db):
+        yield category_name, product_name, product_data['price'], product_quantity(product_data)
+
+
+def read_category_totals(db):
+    """
+    Category rollups embedded by 02_NoSQL_init --rollups (None if the store
+    has none) and the (category name, product name, product data) of the
+    store, from a single read of a TinyDB document.
+    """
+    if snapshot_cache_enabled or isinstance(db, SharedStore):
+        snapshot = get_snapshot(db)
+        return snapshot.category_totals, snapshot.products
+    data = db.all()[0]
+    return data.get('CategoryTotals'), document_products(data)
+
+
+def product_quantity(product_data) -> int:
+    """Total quantity sold of a product, from its rollup when the document has one."""
+    if 'totals' in product_data:
+        return product_data['totals']['quantity']
+    return sum(sale['quantity'] for sale in product_data['sales'].values())
+
+
+def update_rollups(data, category_name: str, product_data, sale_date: str, quantity: int):
+    """Apply a sale (or its removal, with a negative quantity) to the product and category rollups."""
+    if 'totals' not in product_data:
+        return
+    revenue = product_data['price'] * quantity
+    nosql_init.add_to_totals(product_data['totals'], sale_date, quantity, revenue)
+    nosql_init.add_to_totals(data['CategoryTotals'][category_name], sale_date, quantity, revenue)
+
+
+def add_sale(db, category_name: str, product_name: str, ticket: int, sale_date: str, quantity: int):
+    """Add a sale to a product, keeping its sales ordered by date and its rollups up to date."""
+    data = db.all()[0]
+    product_data = data['Categories'][category_name][product_name]
+
+    # Insert after the sales of the same date and renumber from 1
+    sales = list(product_data['sales'].values())
+    position = bisect_right([sale['date'] for sale in sales], sale_date)
+    sales.insert(position, {'ticket': ticket, 'date': sale_date, 'quantity': quantity})
+    product_data['sales'] = {idx + 1: sale for idx, sale in enumerate(sales)}
+
+    update_rollups(data, category_name, product_data, sale_date, quantity)
+    db.update(data, doc_ids=[data.doc_id])
+
+
+def remove_sale(db, category_name: str, product_name: str, sale_key) -> dict:
+    """Remove a sale from a product by its key in the sales map, keeping its rollups up to date."""
+    data = db.all()[0]
+    product_data = data['Categories'][category_name][product_name]
+
+    # Keys are integers in memory but strings once stored as JSON
+    key = next(key for key in product_data['sales'] if str(key) == str(sale_key))
+    removed = product_data['sales'].pop(key)
+    product_data['sales'] = {idx + 1: sale for idx, sale in enumerate(product_data['sales'].values())}
+
+    update_rollups(data, category_name, product_data, removed['date'], -removed['quantity'])
+    db.update(data, doc_ids=[data.doc_id])
+    return removed
+
+
+def iter_sales_between(db, first_day: int, last_day: int, product_name: str = None):
+    """
+    Yield (category name, product name, unit price, quantity, date) of the
+    sales with first_day <= day ordinal <= last_day, of one product or all of
+    them, by binary search on each product's sales in date order:
+    O(log n + k) per product instead of parsing every date.
+    """
+    columnar = get_columnar(db)
+    index = get_indexes(db)
+
+    if columnar is not None:
+        for category_name, name, unit_price, quantity, day in columnar.sales_between(first_day, last_day, product_name):
+            yield category_name, name, unit_price, quantity, date.fromordinal(day).isoformat()
+        return
+
+    if index is not None:
+        products = (
+            ((category_name, product_name, product_data)
+             for category_name, product_data in index.products.get(product_name, []))
+            if product_name is not None else iter_products(db)
+        )
+        for category_name, name, product_data in products:
+            for sale in index.product_sales_between(category_name, name, first_day, last_day):
+                yield category_name, name, product_data['price'], sale['quantity'], sale['date']
+        return
+
+    if isinstance(db, PartitionedStore):
+        # Only open the partitions of the months in range that hold the product
+        first_month = date.fromordinal(first_day).isoformat()[:7]
+        last_month = date.fromordinal(last_day).isoformat()[:7]
+        for partition in db.partitions(first_month, last_month, product_name):
+            for category_name, name, product_data in document_products(db.read(partition)):
+                if product_name is not None and name != product_name:
+                    continue
+                ordinals, sales = ordered_sales(product_data)
+                for sale in sales[bisect_left(ordinals, first_day):bisect_right(ordinals, last_day)]:
+                    yield category_name, name, product_data['price'], sale['quantity'], sale['date']
+        return
+
+    for category_name, name, product_data in iter_products(db):
+        if product_name is not None and name != product_name:
+            continue
+        ordinals, sales = product_ordered_sales(db, category_name, name, product_data)
+        for sale in sales[bisect_left(ordinals, first_day):bisect_right(ordinals, last_day)]:
+            yield category_name, name, product_data['price'], sale['quantity'], sale['date']
+
+
+def get_total_sales_by_category(db, quiet: bool = False) -> dict:
     """
     Equivalent to SQL:
     SELECT SUM(sd.quantity) AS total_quantity, cat.name AS category
@@ -18,25 +718,43 @@ def get_total_sales_by_category(db):
     LEFT JOIN Categories cat ON pr.category_id = cat.id
     GROUP BY category
     """
-    # Get the first (and only) document in our TinyDB
-    data = db.all()[0]
-
     # Initialize counters for each category
     category_totals = defaultdict(int)
 
-    # Iterate through the nested structure
-    for category_name, products in data['Categories'].items():
-        for product_name, product_data in products.items():
+    # The columnar view and the stores without rollups sum the product totals
+    stored_totals = None
+    if get_columnar(db) is not None or isinstance(db, (NDJSONStore, PartitionedStore)):
+        product_totals = iter_product_totals(db)
+    else:
+        stored_totals, products = read_category_totals(db)
+        product_totals = (
+            (category_name, product_name, product_data['price'], product_quantity(product_data))
+            for category_name, product_name, product_data in products
+        )
+
+    if stored_totals is not None:
+        # Read the precomputed category rollups
+        for category_name, totals in stored_totals.items():
+            category_totals[category_name] = totals['quantity']
+    else:
+        # Iterate through the nested structure
+        for category_name, product_name, unit_price, total_quantity in product_totals:
             # Sum up quantities from all sales of this product
-            total_quantity = sum(sale['quantity'] for sale in product_data['sales'].values())
             category_totals[category_name] += total_quantity
 
+    category_totals = dict(category_totals)
+    if not quiet:
+        print_total_sales_by_category(category_totals)
+    return category_totals
+
+
+def print_total_sales_by_category(category_totals: dict):
     print_separator("Get total sales by categories:")
     for category, total in category_totals.items():
         print(f"Category: {category}, Total Quantity: {total}")
 
 
-def get_total_price_by_product(db):
+def get_total_price_by_product(db, quiet: bool = False) -> list:
     """
     Equivalent to SQL:
     SELECT pd.name AS name, pd.price AS unit_price,
@@ -47,26 +765,28 @@ def get_total_price_by_product(db):
     GROUP BY name, pd.price
     ORDER BY total_earned DESC
     """
-    data = db.all()[0]
     product_totals = []
 
     # Calculate totals for each product
-    for category in data['Categories'].values():
-        for product_name, product_data in category.items():
-            total_quantity = sum(sale['quantity'] for sale in product_data['sales'].values())
-            unit_price = product_data['price']
-            total_earned = unit_price * total_quantity
-
-            product_totals.append({
-                'name': product_name,
-                'unit_price': unit_price,
-                'total_saled': total_quantity,
-                'total_earned': total_earned
-            })
+    for category_name, product_name, unit_price, total_quantity in iter_product_totals(db):
+        total_earned = unit_price * total_quantity
+
+        product_totals.append({
+            'name': product_name,
+            'unit_price': unit_price,
+            'total_saled': total_quantity,
+            'total_earned': total_earned
+        })
 
     # Sort by total earned, descending
     product_totals.sort(key=lambda x: x['total_earned'], reverse=True)
 
+    if not quiet:
+        print_total_price_by_product(product_totals)
+    return product_totals
+
+
+def print_total_price_by_product(product_totals: list):
     print_separator("Get total prices for each items:")
     for product in product_totals:
         print(f"Product: {product['name']}")
@@ -75,7 +795,7 @@ def get_total_price_by_product(db):
         print(f"  Total Earned: ${product['total_earned']:.2f}")
 
 
-def get_sales_by_date(db, target_date: str):
+def get_sales_by_date(db, target_date: str, quiet: bool = False) -> list:
     """
     Equivalent to SQL:
     SELECT cat.name AS category, pd.name AS name, pd.price AS unit_price,
@@ -87,26 +807,44 @@ def get_sales_by_date(db, target_date: str):
     LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
     WHERE sl.date = target_date
     """
-    data = db.all()[0]
     daily_sales = []
+    columnar = get_columnar(db)
+    index = get_indexes(db)
 
-    # Collect all sales for the target date
-    for category_name, products in data['Categories'].items():
-        for product_name, product_data in products.items():
-            for sale in product_data['sales'].values():
-                if sale['date'] == target_date:
-                    daily_sales.append({
-                        'category': category_name,
-                        'product': product_name,
-                        'unit_price': product_data['price'],
-                        'quantity': sale['quantity'],
-                        'total_price': product_data['price'] * sale['quantity'],
-                        'date': sale['date']
-                    })
+    # Collect all sales for the target date, from the columnar view or the date index when available
+    if columnar is not None:
+        matches = columnar.sales_on(date.fromisoformat(target_date).toordinal())
+    elif index is not None:
+        matches = (
+            (category_name, product_name, product_data['price'], sale['quantity'])
+            for category_name, product_name, product_data, sale in index.dates.get(target_date, [])
+        )
+    else:
+        day = date_ordinal(target_date)
+        matches = (
+            (category_name, product_name, unit_price, quantity)
+            for category_name, product_name, unit_price, quantity, sale_date in iter_sales_between(db, day, day)
+        )
+
+    for category_name, product_name, unit_price, quantity in matches:
+        daily_sales.append({
+            'category': category_name,
+            'product': product_name,
+            'unit_price': unit_price,
+            'quantity': quantity,
+            'total_price': unit_price * quantity,
+            'date': target_date
+        })
 
     # Sort by category and total price
     daily_sales.sort(key=lambda x: (x['category'], -x['total_price']))
 
+    if not quiet:
+        print_sales_by_date(target_date, daily_sales)
+    return daily_sales
+
+
+def print_sales_by_date(target_date: str, daily_sales: list):
     print_separator(f"Get all sales for date: {target_date}")
     for sale in daily_sales:
         print(f"Category: {sale['category']}")
@@ -115,7 +853,7 @@ def get_sales_by_date(db, target_date: str):
         print(f"  Total Price: ${sale['total_price']:.2f}")
 
 
-def get_product_sales_by_month(db, product_name: str, year: int, month: int):
+def get_product_sales_by_month(db, product_name: str, year: int, month: int, quiet: bool = False) -> list:
     """
     Equivalent to SQL:
     SELECT pd.name, pd.price AS unit_price, sd.quantity,
@@ -125,28 +863,28 @@ def get_product_sales_by_month(db, product_name: str, year: int, month: int):
     LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
     WHERE pd.name = product_name AND sl.date BETWEEN start_date AND end_date
     """
-    data = db.all()[0]
-    monthly_sales = []
-
-    # Find the product in our nested structure
-    for category in data['Categories'].values():
-        if product_name in category:
-            product_data = category[product_name]
-
-            # Filter sales for the specified month
-            for sale in product_data['sales'].values():
-                sale_date = datetime.strptime(sale['date'], '%Y-%m-%d')
-                if sale_date.year == year and sale_date.month == month:
-                    monthly_sales.append({
-                        'date': sale['date'],
-                        'quantity': sale['quantity'],
-                        'unit_price': product_data['price'],
-                        'total_price': product_data['price'] * sale['quantity']
-                    })
+    # Binary search the month in the product's sales, in date order
+    first_day, last_day = month_ordinals(year, month)
+    monthly_sales = [
+        {
+            'date': sale_date,
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'total_price': unit_price * quantity
+        }
+        for category_name, name, unit_price, quantity, sale_date in iter_sales_between(db, first_day, last_day,
+                                                                                       product_name)
+    ]
 
     # Sort by date
     monthly_sales.sort(key=lambda x: x['date'])
 
+    if not quiet:
+        print_product_sales_by_month(product_name, year, month, monthly_sales)
+    return monthly_sales
+
+
+def print_product_sales_by_month(product_name: str, year: int, month: int, monthly_sales: list):
     print_separator(f"Get all sales of {product_name} for {year}-{month:02d}")
     for sale in monthly_sales:
         print(f"Date: {sale['date']}")
@@ -154,7 +892,51 @@ def get_product_sales_by_month(db, product_name: str, year: int, month: int):
         print(f"  Total Price: ${sale['total_price']:.2f}")
 
 
-def get_hierarchical_sales_summary(db):
+def get_sales_in_range(db, start_date: str, end_date: str, quiet: bool = False) -> list:
+    """
+    Equivalent to SQL:
+    SELECT cat.name AS category, pd.name AS name, pd.price AS unit_price,
+           sd.quantity AS quantity, pd.price * sd.quantity AS total_price,
+           sl.date AS date
+    FROM Categories cat
+    LEFT JOIN Products pd ON (cat.id = pd.category_id)
+    LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
+    LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
+    WHERE sl.date BETWEEN start_date AND end_date
+    ORDER BY date, category, total_price DESC
+    """
+    range_sales = [
+        {
+            'category': category_name,
+            'product': product_name,
+            'unit_price': unit_price,
+            'quantity': quantity,
+            'total_price': unit_price * quantity,
+            'date': sale_date
+        }
+        for category_name, product_name, unit_price, quantity, sale_date
+        in iter_sales_between(db, date_ordinal(start_date), date_ordinal(end_date))
+    ]
+
+    # Sort by date, category and total price
+    range_sales.sort(key=lambda x: (x['date'], x['category'], -x['total_price']))
+
+    if not quiet:
+        print_sales_in_range(start_date, end_date, range_sales)
+    return range_sales
+
+
+def print_sales_in_range(start_date: str, end_date: str, range_sales: list):
+    print_separator(f"Get all sales from {start_date} to {end_date}")
+    for sale in range_sales:
+        print(f"Date: {sale['date']}")
+        print(f"  Category: {sale['category']}")
+        print(f"  Product: {sale['product']}")
+        print(f"  Quantity: {sale['quantity']}")
+        print(f"  Total Price: ${sale['total_price']:.2f}")
+
+
+def get_hierarchical_sales_summary(db, quiet: bool = False) -> dict:
     """
     Shows total quantities sold for each product and category
     Equivalent to SQL UNION query:
@@ -176,40 +958,72 @@ def get_hierarchical_sales_summary(db):
         GROUP BY Type
         ORDER BY Quantity DESC, Type
     """
-    data = db.all()[0]
-
     # Calculate totals for both categories and products
     category_totals = defaultdict(int)
     product_totals = defaultdict(int)
 
-    for category_name, products in data['Categories'].items():
-        for product_name, product_data in products.items():
-            product_quantity = sum(sale['quantity'] for sale in product_data['sales'].values())
-            product_totals[product_name] = product_quantity
-            category_totals[category_name] += product_quantity
+    for category_name, product_name, unit_price, quantity in iter_product_totals(db):
+        product_totals[product_name] = quantity
+        category_totals[category_name] += quantity
 
+    summary = {
+        'categories': dict(category_totals),
+        'products': sorted(product_totals.items(), key=lambda x: (-x[1], x[0])),
+    }
+    if not quiet:
+        print_hierarchical_sales_summary(summary)
+    return summary
+
+
+def print_hierarchical_sales_summary(summary: dict):
     print_separator("Get the count of quantities sold (hierarchical summary):")
     # Print category totals
     print("\nCategory Totals:")
-    for category, total in category_totals.items():
+    for category, total in summary['categories'].items():
         print(f"{category}: {total}")
 
     # Print product totals
     print("\nProduct Totals:")
-    sorted_products = sorted(product_totals.items(), key=lambda x: (-x[1], x[0]))
-    for product, total in sorted_products:
+    for product, total in summary['products']:
         print(f"{product}: {total}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the NoSQL analyses on the hierarchical store.")
+    parser.add_argument("--ndjson", metavar="PATH",
+                        help="Read an NDJSON export of 02_NoSQL_init instead of the TinyDB document")
+    parser.add_argument("--partitioned", metavar="DIRECTORY",
+                        help="Read the partitioned store of 02_NoSQL_init --partitioned instead")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes aggregating the partitions (default: one per CPU, 1: none)")
+    parser.add_argument("--indexes", action="store_true",
+                        help="Build secondary indexes once and use them for the point lookups")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Build a columnar NumPy view once and compute the analyses on it")
+    return parser.parse_args()
+
+
 def main():
-    # Connect to TinyDB
-    db = TinyDB('data/tinydb_shop.json')
+    args = parse_args()
+
+    # Connect to TinyDB, or open the NDJSON export or the partitioned store
+    if args.partitioned:
+        db = PartitionedStore(args.partitioned, args.workers)
+    elif args.ndjson:
+        db = NDJSONStore(args.ndjson)
+    else:
+        db = TinyDB('data/tinydb_shop.json')
+    if args.indexes:
+        enable_indexes(db)
+    if args.columnar:
+        enable_columnar(db)
 
     # Run all our analysis functions
     get_total_sales_by_category(db)
     get_total_price_by_product(db)
     get_sales_by_date(db, '2024-08-10')
     get_product_sales_by_month(db, 'Laptop', 2024, 8)
+    get_sales_in_range(db, '2024-08-01', '2024-08-03')
     get_hierarchical_sales_summary(db)
 
     # Close the connection
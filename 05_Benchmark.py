@@ -1,31 +1,65 @@
+import os
+import csv
+import sys
+import json
+import math
 import time
+import random
+import tracemalloc
+import shutil
+import threading
+import subprocess
+import argparse
+import tempfile
 import importlib
 import statistics
 from typing import List, Dict
+from datetime import date, timedelta
 import matplotlib.pyplot as plt
 import seaborn as sns
 import duckdb
-from tinydb import TinyDB
+import pyarrow as pa
+from tinydb import JSONStorage
 
-# Global variables to store timing results and database connections
-sql_times = {}
-nosql_times = {}
+sql_manip = importlib.import_module("03_SQLManip")
+
+# Global database connections
 sql_db = None
 nosql_db = None
-
-def initialize_databases(sql_path: str, nosql_path: str):
+relational_db = None
+
+class RunSettings:
+    """
+    Repetition settings of the timing loops: timed runs and untimed warmup
+    runs per operation, and in run-until-stable mode the target relative
+    standard error of the mean with an upper bound on the runs.
+    """
+
+    def __init__(self, num_runs: int = 100, warmup_runs: int = 5, stable_rel_error: float = None,
+                 max_runs: int = 1000):
+        self.num_runs = num_runs
+        self.warmup_runs = warmup_runs
+        self.stable_rel_error = stable_rel_error
+        self.max_runs = max(max_runs, num_runs)
+
+def initialize_databases(sql_path: str, nosql_path: str, storage: str = "json", relational_path: str = None):
     """Initialize database connections."""
-    global sql_db, nosql_db
+    global sql_db, nosql_db, relational_db
+    nosql_init = importlib.import_module("02_NoSQL_init")
     sql_db = duckdb.connect(sql_path)
-    nosql_db = TinyDB(nosql_path)
+    nosql_db = nosql_init.open_tinydb(nosql_path, storage)
+    relational_db = nosql_init.open_tinydb(relational_path, storage) if relational_path else None
 
 def close_databases():
     """Close database connections."""
-    global sql_db, nosql_db
+    global sql_db, nosql_db, relational_db
     if sql_db:
         sql_db.close()
     if nosql_db:
         nosql_db.close()
+    if relational_db:
+        relational_db.close()
+        relational_db = None
 
 def time_operation(func, *args) -> float:
     """Measure execution time of a function."""
@@ -34,105 +68,620 @@ def time_operation(func, *args) -> float:
     end_time = time.perf_counter()
     return end_time - start_time
 
-def time_sql_queries(num_runs: int) -> Dict[str, List[float]]:
-    """Time each SQL query multiple times."""
-    global sql_times
-
-    sql_queries = {
-        "Category Sales": """
-            SELECT SUM(sd.quantity) AS total_quantity, cat.name AS category
-            FROM SaleDetails sd
-            LEFT JOIN Products pr ON sd.product_id = pr.id
-            LEFT JOIN Categories cat ON pr.category_id = cat.id
-            GROUP BY category
-        """,
-        "Product Prices": """
-            SELECT pd.name AS name, pd.price AS unit_price,
-                COALESCE(SUM(sd.quantity), 0) AS total_saled,
-                pd.price * total_saled AS total_earned
-            FROM Products pd
-            LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
-            GROUP BY name, pd.price
-            ORDER BY total_earned DESC
-        """,
-        "Daily Sales": """
-            SELECT cat.name AS category, pd.name AS name,
-                pd.price AS unit_price, sd.quantity AS quantity,
-                pd.price * sd.quantity AS total_price, sl.date AS date
-            FROM Categories cat
-            LEFT JOIN Products pd ON (cat.id = pd.category_id)
-            LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
-            LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
-            WHERE sl.date = '2024-08-10'
-        """,
-        "Product Monthly": """
-            SELECT pd.name, pd.price AS unit_price, sd.quantity,
-                pd.price * sd.quantity AS total_price, sl.date
-            FROM Products pd
-            LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
-            LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
-            WHERE pd.name = 'Laptop' 
-            AND sl.date >= '2024-08-01' 
-            AND sl.date <= '2024-08-31'
-        """
+def is_stable(times: List[float], rel_error: float) -> bool:
+    """Whether the standard error of the mean is within rel_error of the mean."""
+    if len(times) < 2:
+        return False
+    standard_error = statistics.stdev(times) / math.sqrt(len(times))
+    return standard_error <= rel_error * statistics.mean(times)
+
+def repeat_operation(func, *args, settings: RunSettings) -> List[float]:
+    """
+    Time a function settings.num_runs times after settings.warmup_runs untimed
+    calls. In run-until-stable mode, keep timing until the mean is stable or
+    settings.max_runs is reached.
+    """
+    for _ in range(settings.warmup_runs):
+        func(*args)
+    times = [time_operation(func, *args) for _ in range(settings.num_runs)]
+    if settings.stable_rel_error is not None:
+        while len(times) < settings.max_runs and not is_stable(times, settings.stable_rel_error):
+            times.append(time_operation(func, *args))
+    return times
+
+SQL_QUERIES = {
+    "Category Sales": """
+        SELECT SUM(sd.quantity) AS total_quantity, cat.name AS category
+        FROM SaleDetails sd
+        LEFT JOIN Products pr ON sd.product_id = pr.id
+        LEFT JOIN Categories cat ON pr.category_id = cat.id
+        GROUP BY category
+    """,
+    "Product Prices": """
+        SELECT pd.name AS name, pd.price AS unit_price,
+            COALESCE(SUM(sd.quantity), 0) AS total_saled,
+            pd.price * total_saled AS total_earned
+        FROM Products pd
+        LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
+        GROUP BY name, pd.price
+        ORDER BY total_earned DESC
+    """,
+    "Daily Sales": """
+        SELECT cat.name AS category, pd.name AS name,
+            pd.price AS unit_price, sd.quantity AS quantity,
+            pd.price * sd.quantity AS total_price, sl.date AS date
+        FROM Categories cat
+        LEFT JOIN Products pd ON (cat.id = pd.category_id)
+        LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
+        LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
+        WHERE sl.date = '2024-08-10'
+    """,
+    "Product Monthly": """
+        SELECT pd.name, pd.price AS unit_price, sd.quantity,
+            pd.price * sd.quantity AS total_price, sl.date
+        FROM Products pd
+        LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
+        LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
+        WHERE pd.name = 'Laptop' 
+        AND sl.date >= '2024-08-01' 
+        AND sl.date <= '2024-08-31'
+    """
+}
+
+def fetch_many(result, batch_size: int = 10_000):
+    """Stream the result in batches of rows."""
+    while result.fetchmany(batch_size):
+        pass
+
+# Ways of consuming a query result, from none at all to zero-copy columnar
+FETCH_MODES = {
+    "execute": lambda result: None,
+    "fetchall": lambda result: result.fetchall(),
+    "fetchdf": lambda result: result.fetchdf(),
+    "fetchnumpy": lambda result: result.fetchnumpy(),
+    "arrow": sql_manip.fetch_arrow,
+    "fetchmany": fetch_many,
+}
+
+def run_sql_query(query: str, fetch_mode: str):
+    """Execute a query and consume its result with the given fetch mode."""
+    FETCH_MODES[fetch_mode](sql_db.execute(query))
+
+def count_sql_rows() -> Dict[str, int]:
+    """Number of rows returned by each SQL query."""
+    return {query_name: len(sql_db.execute(query).fetchall()) for query_name, query in SQL_QUERIES.items()}
+
+def time_sql_queries(settings: RunSettings, fetch_mode: str = "fetchall") -> Dict[str, List[float]]:
+    """Time each SQL query multiple times, including the fetch of its result."""
+    return {
+        query_name: repeat_operation(run_sql_query, query, fetch_mode, settings=settings)
+        for query_name, query in SQL_QUERIES.items()
     }
 
-    for query_name, query in sql_queries.items():
-        times = []
-        for _ in range(num_runs):
-            duration = time_operation(sql_db.execute, query)
-            times.append(duration)
-        sql_times[query_name] = times
+def time_fetch_modes(settings: RunSettings) -> Dict[str, Dict[str, List[float]]]:
+    """Time each SQL query with every fetch mode."""
+    fetch_times = {}
+    for fetch_mode in FETCH_MODES:
+        fetch_times[fetch_mode] = {}
+        for query_name, query in SQL_QUERIES.items():
+            fetch_times[fetch_mode][query_name] = repeat_operation(run_sql_query, query, fetch_mode,
+                                                                   settings=settings)
+    return fetch_times
+
+def print_fetch_statistics(fetch_times: Dict[str, Dict[str, List[float]]], row_counts: Dict[str, int]):
+    """Print the mean time of each query per fetch mode, with the number of rows returned."""
+    print("\nFetch Mode Statistics:")
+    print("=" * 80)
+
+    for query_name in SQL_QUERIES:
+        print(f"\nQuery: {query_name} ({row_counts[query_name]} rows)")
+        print("-" * 40)
+        for fetch_mode, times in fetch_times.items():
+            print(f"  {fetch_mode}: mean {statistics.mean(times[query_name]):.6f} seconds, "
+                  f"median {statistics.median(times[query_name]):.6f} seconds")
+
+def nosql_operations(module_name: str = "04_NoSQLManip") -> Dict[str, callable]:
+    """NoSQL operations of a module matching the SQL queries, computing results without printing them."""
+    nosql_module = importlib.import_module(module_name)
+
+    return {
+        "Category Sales": lambda db: nosql_module.get_total_sales_by_category(db, quiet=True),
+        "Product Prices": lambda db: nosql_module.get_total_price_by_product(db, quiet=True),
+        "Daily Sales": lambda db: nosql_module.get_sales_by_date(db, '2024-08-10', quiet=True),
+        "Product Monthly": lambda db: nosql_module.get_product_sales_by_month(db, 'Laptop', 2024, 8, quiet=True)
+    }
 
-    return sql_times
+def time_daily_lookups(num_lookups: int = 1000, num_runs: int = 5, seed: int = 42) -> Dict[str, float]:
+    """
+    Time num_lookups daily sales lookups on random days of 2024 (best of num_runs):
+    one query per day with the date inlined in the SQL text or bound as a
+    parameter, against all days answered by one batched query.
+    """
+    rng = random.Random(seed)
+    days = [date(2024, 1, 1) + timedelta(days=rng.randrange(366)) for _ in range(num_lookups)]
+    query = sql_manip.QUERIES["daily_sales"]
+    statements = sql_manip.NamedQueries(sql_db)
+
+    def literal_lookups():
+        for day in days:
+            sql_db.execute(query.replace("$date", f"'{day.isoformat()}'")).fetchall()
+
+    def parameter_lookups():
+        for day in days:
+            statements.execute("daily_sales", date=day).fetchall()
+
+    def batched_lookup():
+        statements.execute("daily_sales_batch", dates=days).fetchall()
+
+    lookups = {
+        "Individual (inlined SQL)": literal_lookups,
+        "Individual (parameters)": parameter_lookups,
+        "Batched (one query)": batched_lookup,
+    }
+    return {name: min(time_operation(lookup) for _ in range(num_runs)) for name, lookup in lookups.items()}
 
-def time_nosql_queries(num_runs: int) -> Dict[str, List[float]]:
-    """Time each NoSQL operation multiple times."""
-    global nosql_times
+def print_lookup_times(lookup_times: Dict[str, float], num_lookups: int):
+    """Print the total and per-lookup time of each way of answering the lookups."""
+    print(f"\nDaily Sales Lookups ({num_lookups} days):")
+    print("=" * 80)
 
+    batched = lookup_times["Batched (one query)"]
+    for name, duration in lookup_times.items():
+        print(f"  {name}: {duration:.6f} seconds ({duration / num_lookups * 1e6:.1f} µs per lookup, "
+              f"{duration / batched:.1f}x the batched query)")
+
+def time_nosql_operations(settings: RunSettings, module_name: str = "04_NoSQLManip",
+                          db=None) -> Dict[str, List[float]]:
+    """Time each NoSQL operation of a module multiple times, on the hierarchical store by default."""
+    operation_times = {}
+    for op_name, operation in nosql_operations(module_name).items():
+        operation_times[op_name] = repeat_operation(operation, nosql_db if db is None else db, settings=settings)
+
+    return operation_times
+
+def time_nosql_queries(settings: RunSettings, mode: str = "cold") -> Dict[str, List[float]]:
+    """
+    Time each NoSQL operation multiple times, either re-reading the store on
+    every call (cold) or from the shared snapshot, taken before timing (warm).
+    """
     # Import NoSQL manipulation module
     nosql_module = importlib.import_module("04_NoSQLManip")
+    nosql_module.set_snapshot_cache(mode == "warm")
+    if mode == "warm":
+        nosql_module.refresh_snapshot(nosql_db)
+
+    nosql_times = time_nosql_operations(settings)
+    nosql_module.set_snapshot_cache(False)
+    return nosql_times
 
-    operations = {
-        "Category Sales": nosql_module.get_total_sales_by_category,
-        "Product Prices": nosql_module.get_total_price_by_product,
-        "Daily Sales": lambda db: nosql_module.get_sales_by_date(db, '2024-08-10'),
-        "Product Monthly": lambda db: nosql_module.get_product_sales_by_month(db, 'Laptop', 2024, 8)
+def time_columnar_queries(settings: RunSettings) -> Dict[str, List[float]]:
+    """Time each NoSQL operation on the columnar view of the document, built before timing."""
+    nosql_module = importlib.import_module("04_NoSQLManip")
+    nosql_module.enable_columnar(nosql_db)
+    columnar_times = time_nosql_operations(settings)
+    nosql_module.disable_columnar(nosql_db)
+
+    return columnar_times
+
+def time_relational_queries(settings: RunSettings) -> Dict[str, List[float]]:
+    """Time each NoSQL operation on the relational store, answered with hash joins by 06_RelationalNoSQLManip."""
+    return time_nosql_operations(settings, "06_RelationalNoSQLManip", relational_db)
+
+def shared_store_load(path: str, num_readers: int, duration: float, write_interval: float = 0.05,
+                      storage: str = "json") -> Dict[str, float]:
+    """
+    Have num_readers threads run the NoSQL operations on a SharedStore copy of
+    a hierarchical store for duration seconds, while a writer thread adds a
+    sale every write_interval seconds. Returns reader throughput and latencies.
+    """
+    nosql_module = importlib.import_module("04_NoSQLManip")
+    operations = list(nosql_operations().values())
+
+    with tempfile.TemporaryDirectory() as directory:
+        store_path = os.path.join(directory, os.path.basename(path))
+        shutil.copyfile(path, store_path)
+        store = nosql_module.SharedStore(store_path, storage)
+        category_name, product_name, _ = store.current().products[0]
+
+        deadline = time.perf_counter() + duration
+        latencies = [[] for _ in range(num_readers)]
+        errors = []
+        writes = 0
+
+        def reader(index: int):
+            position = index
+            while time.perf_counter() < deadline:
+                try:
+                    latencies[index].append(time_operation(operations[position % len(operations)], store))
+                except Exception as error:
+                    errors.append(error)
+                position += 1
+
+        def writer():
+            nonlocal writes
+            while time.perf_counter() < deadline:
+                store.write(nosql_module.add_sale, category_name, product_name, -1 - writes, '2024-08-10', 1)
+                writes += 1
+                time.sleep(write_interval)
+
+        threads = [threading.Thread(target=reader, args=(index,)) for index in range(num_readers)]
+        threads.append(threading.Thread(target=writer))
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start_time
+
+    reads = [latency for reader_latencies in latencies for latency in reader_latencies]
+    return {
+        "readers": num_readers,
+        "reads": len(reads),
+        "throughput": len(reads) / elapsed,
+        "p50": percentile(reads, 50),
+        "p95": percentile(reads, 95),
+        "p99": percentile(reads, 99),
+        "writes": writes,
+        "errors": len(errors),
     }
 
-    for op_name, operation in operations.items():
-        times = []
-        for _ in range(num_runs):
-            duration = time_operation(operation, nosql_db)
-            times.append(duration)
-        nosql_times[op_name] = times
+def print_shared_store_load(loads: List[Dict[str, float]]):
+    """Print reader throughput and latency for each number of reader threads."""
+    print("\nShared Store Load (readers while writing):")
+    print("=" * 80)
 
-    return nosql_times
+    for load in loads:
+        print(f"  {load['readers']} readers: {load['throughput']:.1f} reads per second, "
+              f"p50 {load['p50']:.6f} / p95 {load['p95']:.6f} / p99 {load['p99']:.6f} seconds, "
+              f"{load['writes']} writes, {load['errors']} errors")
+
+def create_scaled_database(directory: str, scale_factor: float, seed: int = 42, optimized: bool = False) -> str:
+    """Create a bulk-filled DuckDB database for a scale factor, optionally with the optimized layout, and return its path."""
+    sql_init = importlib.import_module("01_SQL_init")
+    path = os.path.join(directory, f"duckdb_shop_sf{scale_factor:g}{'_optimized' if optimized else ''}.db")
+    sql_init.init_db(path)
+    sql_init.bulk_fill_db(path, scale_factor, seed)
+    if optimized:
+        sql_init.optimize_layout(path)
+    return path
+
+def compare_layouts(scale_factors: List[float], settings: RunSettings,
+                    query_names=("Daily Sales", "Product Monthly")) -> Dict[float, Dict[str, Dict[str, float]]]:
+    """Time the date and product lookups on the default and the optimized layout of the same data."""
+    global sql_db
+
+    layout_stats = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale_factor in scale_factors:
+            layout_stats[scale_factor] = {}
+            for layout, optimized in (("default", False), ("optimized", True)):
+                sql_db = duckdb.connect(create_scaled_database(directory, scale_factor, optimized=optimized),
+                                        read_only=True)
+                layout_stats[scale_factor][layout] = {
+                    query_name: summarize_times(repeat_operation(run_sql_query, SQL_QUERIES[query_name], "fetchall",
+                                                                 settings=settings))
+                    for query_name in query_names
+                }
+                sql_db.close()
+                sql_db = None
+
+    return layout_stats
+
+def print_layout_comparison(layout_stats: Dict[float, Dict[str, Dict[str, float]]]):
+    """Print the median time of each lookup per layout and the speedup of the optimized one."""
+    print("\nLayout Comparison:")
+    print("=" * 80)
+
+    for scale_factor, layouts in layout_stats.items():
+        print(f"\nScale factor: {scale_factor:g}")
+        print("-" * 40)
+        for query_name, default_stats in layouts["default"].items():
+            optimized_stats = layouts["optimized"][query_name]
+            print(f"  {query_name}: default {default_stats['p50']:.6f} seconds, "
+                  f"optimized {optimized_stats['p50']:.6f} seconds "
+                  f"({default_stats['p50'] / optimized_stats['p50']:.2f}x)")
+
+def create_scaled_stores(directory: str, scale_factor: float, storage: str = "json") -> (str, str, str):
+    """
+    Create a DuckDB database and its hierarchical and relational TinyDB stores
+    for a scale factor and return their paths.
+    """
+    nosql_init = importlib.import_module("02_NoSQL_init")
+    extension = nosql_init.STORAGES[storage][1]
+    sql_path = create_scaled_database(directory, scale_factor)
+    nosql_path = os.path.join(directory, f"hierarchical_tinydb_shop_sf{scale_factor:g}{extension}")
+    relational_path = os.path.join(directory, f"relational_tinydb_shop_sf{scale_factor:g}{extension}")
+
+    con = duckdb.connect(sql_path, read_only=True)
+    hierarchical_tinydb = nosql_init.open_tinydb(nosql_path, storage)
+    hierarchical_tinydb.insert(nosql_init.convert_to_hierarchical_json(con))
+    hierarchical_tinydb.close()
+    nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(con), relational_path, "direct", storage)
+    con.close()
+
+    return sql_path, nosql_path, relational_path
+
+# Above this many SaleDetails rows, the quadratic one-insert-per-record write is skipped
+MAX_INSERT_MODE_ROWS = 2_000
+
+def time_conversions(scale_factors: List[float], num_runs: int = 3) -> Dict[float, Dict[str, float]]:
+    """Time the DuckDB to TinyDB conversions at several scale factors (best of num_runs)."""
+    nosql_init = importlib.import_module("02_NoSQL_init")
+
+    def relational_conversion(mode: str, path: str):
+        def conversion(con):
+            if os.path.exists(path):
+                os.remove(path)
+            if mode == "arrow":
+                nosql_init.write_relational_json_arrow(con, path)
+            else:
+                nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(con), path, mode)
+        return conversion
+
+    conversion_times = {}
+    with tempfile.TemporaryDirectory() as directory:
+        relational_path = os.path.join(directory, "relational_tinydb_shop.json")
+        conversions = {
+            "Hierarchical (Python)": nosql_init.convert_to_hierarchical_json,
+            "Hierarchical (DuckDB)": nosql_init.convert_to_hierarchical_json_duckdb,
+            "Relational (insert)": relational_conversion("insert", relational_path),
+            "Relational (bulk)": relational_conversion("bulk", relational_path),
+            "Relational (direct)": relational_conversion("direct", relational_path),
+            "Relational (Arrow JSON writer)": relational_conversion("arrow", relational_path),
+        }
+
+        for scale_factor in scale_factors:
+            con = duckdb.connect(create_scaled_database(directory, scale_factor), read_only=True)
+            num_rows = con.execute("SELECT COUNT(*) FROM SaleDetails").fetchone()[0]
+            conversion_times[scale_factor] = {"rows": num_rows}
+            for conversion_name, conversion in conversions.items():
+                if conversion_name == "Relational (insert)" and num_rows > MAX_INSERT_MODE_ROWS:
+                    continue
+                times = [time_operation(conversion, con) for _ in range(num_runs)]
+                conversion_times[scale_factor][conversion_name] = min(times)
+            con.close()
+
+    return conversion_times
+
+def print_conversion_times(conversion_times: Dict[float, Dict[str, float]]):
+    """Print conversion times with the cost per SaleDetails row, which stays flat when scaling is linear."""
+    print("\nConversion Timings:")
+    print("=" * 80)
+
+    for scale_factor, timings in conversion_times.items():
+        print(f"\nScale factor: {scale_factor:g} ({timings['rows']} sale details)")
+        print("-" * 40)
+        for conversion_name, duration in timings.items():
+            if conversion_name == "rows":
+                continue
+            per_row = duration / timings["rows"] * 1e6
+            print(f"  {conversion_name}: {duration:.6f} seconds ({per_row:.3f} µs per row)")
+
+def relational_conversion_run(sql_path: str, engine: str) -> Dict[str, float]:
+    """
+    Write the relational JSON store once with the pandas path (DataFrames, then
+    the whole document written directly) or the Arrow JSON writer, and return
+    its wall time. A second, traced run gives its peak memory: the peak of the
+    Python allocations (NumPy arrays included) seen by tracemalloc, plus the
+    peak of the Arrow memory pool. Buffers DuckDB allocates itself are left out.
+    """
+    nosql_init = importlib.import_module("02_NoSQL_init")
+
+    def convert(con, path: str):
+        if engine == "arrow":
+            nosql_init.write_relational_json_arrow(con, path)
+        else:
+            nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(con), path, "direct")
+
+    con = duckdb.connect(sql_path, read_only=True)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "relational_tinydb_shop.json")
+        seconds = time_operation(convert, con, path)
+        os.remove(path)
+
+        pool = pa.default_memory_pool()
+        pool_before = pool.bytes_allocated()
+        tracemalloc.start()
+        convert(con, path)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    con.close()
+    return {"seconds": seconds, "peak_memory": traced_peak + max(pool.max_memory() - pool_before, 0)}
+
+def compare_relational_conversions(scale_factors: List[float], num_runs: int = 3) -> Dict[float, Dict[str, Dict[str, float]]]:
+    """
+    Compare the pandas and Arrow relational conversions at several scale
+    factors, each run in a fresh interpreter so that the Arrow memory pool
+    peak is its own (best of num_runs for both measures).
+    """
+    conversion_stats = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale_factor in scale_factors:
+            sql_path = create_scaled_database(directory, scale_factor)
+            conversion_stats[scale_factor] = {}
+            for engine in ("pandas", "arrow"):
+                runs = [
+                    json.loads(subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--conversion-run", sql_path, engine],
+                        capture_output=True, text=True, check=True,
+                    ).stdout)
+                    for _ in range(num_runs)
+                ]
+                conversion_stats[scale_factor][engine] = {
+                    measure: min(run[measure] for run in runs) for measure in ("seconds", "peak_memory")
+                }
+    return conversion_stats
+
+def print_relational_conversions(conversion_stats: Dict[float, Dict[str, Dict[str, float]]]):
+    """Print wall time and peak memory of both relational conversions, with the Arrow/pandas ratios."""
+    print("\nRelational Conversion (pandas vs Arrow):")
+    print("=" * 80)
+
+    for scale_factor, engines in conversion_stats.items():
+        print(f"\nScale factor: {scale_factor:g}")
+        print("-" * 40)
+        for engine, stats in engines.items():
+            print(f"  {engine}: {stats['seconds']:.6f} seconds, peak memory +{stats['peak_memory'] / 2**20:.1f} MiB")
+        pandas_stats, arrow_stats = engines["pandas"], engines["arrow"]
+        print(f"  Arrow/pandas: {arrow_stats['seconds'] / pandas_stats['seconds']:.2f}x time, "
+              f"{arrow_stats['peak_memory'] / max(pandas_stats['peak_memory'], 1):.2f}x peak memory")
+
+def compare_storages(json_paths: List[str], num_runs: int = 5) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Copy JSON TinyDB stores to every storage backend and compare file size and load time (best of num_runs)."""
+    nosql_init = importlib.import_module("02_NoSQL_init")
+
+    def load(storage_cls, path: str):
+        storage = storage_cls(path)
+        storage.read()
+        storage.close()
+
+    storage_stats = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for json_path in json_paths:
+            json_storage = JSONStorage(json_path, access_mode="r")
+            data = json_storage.read()
+            json_storage.close()
+
+            store_name = os.path.splitext(os.path.basename(json_path))[0]
+            storage_stats[store_name] = {}
+            for storage_name, (storage_cls, extension) in nosql_init.STORAGES.items():
+                path = json_path
+                if storage_cls is not JSONStorage:
+                    path = os.path.join(directory, store_name + extension)
+                    storage = storage_cls(path)
+                    storage.write(data)
+                    storage.close()
+
+                storage_stats[store_name][storage_name] = {
+                    "size": os.path.getsize(path),
+                    "load": min(time_operation(load, storage_cls, path) for _ in range(num_runs)),
+                }
+
+    return storage_stats
+
+def print_storage_comparison(storage_stats: Dict[str, Dict[str, Dict[str, float]]]):
+    """Print file size and load time of each store for every storage backend."""
+    print("\nStorage Comparison:")
+    print("=" * 80)
+
+    for store_name, storages in storage_stats.items():
+        print(f"\nStore: {store_name}")
+        print("-" * 40)
+        json_stats = storages["json"]
+        for storage_name, storage_stat in storages.items():
+            print(f"  {storage_name}: {storage_stat['size'] / 1024:.1f} KiB "
+                  f"({storage_stat['size'] / json_stats['size']:.0%} of JSON), "
+                  f"load {storage_stat['load']:.6f} seconds "
+                  f"({storage_stat['load'] / json_stats['load']:.0%} of JSON)")
+
+def timed(func, *args):
+    """Call a function and return its result with the time it took."""
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+def cold_start_phases(sql_path: str, nosql_path: str, storage: str = "json",
+                      query_name: str = "Category Sales") -> Dict[str, Dict[str, float]]:
+    """
+    Time each phase of using an engine from scratch: open the database, load it
+    (TinyDB reads and parses the whole file, DuckDB defers this to the query),
+    run a first query and close it.
+    """
+    nosql_init = importlib.import_module("02_NoSQL_init")
+    nosql_module = importlib.import_module("04_NoSQLManip")
+    phases = {"SQL": {}, "NoSQL": {}}
+
+    con, phases["SQL"]["open"] = timed(lambda: duckdb.connect(sql_path, read_only=True))
+    _, phases["SQL"]["first query"] = timed(lambda: con.execute(SQL_QUERIES[query_name]).fetchall())
+    _, phases["SQL"]["close"] = timed(con.close)
+
+    snapshot_cache = nosql_module.snapshot_cache_enabled
+    nosql_module.set_snapshot_cache(True)
+    db, phases["NoSQL"]["open"] = timed(nosql_init.open_tinydb, nosql_path, storage)
+    _, phases["NoSQL"]["load"] = timed(nosql_module.refresh_snapshot, db)
+    _, phases["NoSQL"]["first query"] = timed(nosql_operations()[query_name], db)
+    _, phases["NoSQL"]["close"] = timed(db.close)
+    nosql_module.set_snapshot_cache(snapshot_cache)
+
+    for engine_phases in phases.values():
+        engine_phases["total"] = sum(engine_phases.values())
+    return phases
+
+def cold_start_in_subprocess(sql_path: str, nosql_path: str, storage: str) -> Dict[str, Dict[str, float]]:
+    """Time the cold-start phases in a fresh interpreter, which shares nothing with this one but the OS page cache."""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--cold-run", sql_path, nosql_path, "--storage", storage],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)
+
+def time_cold_starts(sql_path: str, nosql_path: str, storage: str, num_runs: int,
+                     fresh_process: bool = False) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Summarize the cold-start phases of num_runs runs, together with the size of each database file."""
+    runs = [
+        cold_start_in_subprocess(sql_path, nosql_path, storage) if fresh_process
+        else cold_start_phases(sql_path, nosql_path, storage)
+        for _ in range(num_runs)
+    ]
+
+    stats = {}
+    for engine, path in (("SQL", sql_path), ("NoSQL", nosql_path)):
+        stats[engine] = {"size": os.path.getsize(path)}
+        for phase in runs[0][engine]:
+            stats[engine][phase] = summarize_times([run[engine][phase] for run in runs])
+    return stats
+
+def print_cold_starts(cold_stats: Dict[str, Dict[str, Dict[str, Dict[str, float]]]]):
+    """Print the median time of each cold-start phase per dataset, and the total per MiB of database file."""
+    print("\nCold Start Statistics:")
+    print("=" * 80)
+
+    for dataset, engines in cold_stats.items():
+        print(f"\nDataset: {dataset}")
+        print("-" * 40)
+        for engine, phases in engines.items():
+            size_mib = phases["size"] / 2 ** 20
+            print(f"\n{engine} ({size_mib:.2f} MiB):")
+            for phase, phase_stats in phases.items():
+                if phase == "size":
+                    continue
+                print(f"  {phase}: median {phase_stats['p50']:.6f} seconds, p95 {phase_stats['p95']:.6f} seconds")
+            print(f"  total per MiB: {phases['total']['p50'] / size_mib:.6f} seconds")
+
+def percentile(times: List[float], percent: int) -> float:
+    """Percentile of the timings, interpolated between the closest runs."""
+    if len(times) < 2:
+        return times[0]
+    return statistics.quantiles(times, n=100, method="inclusive")[percent - 1]
+
+def summarize_times(times: List[float]) -> Dict[str, float]:
+    """Central tendency, spread, tail latencies and throughput of a list of timings."""
+    return {
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "std_dev": statistics.stdev(times) if len(times) > 1 else 0,
+        "min": min(times),
+        "max": max(times),
+        "p50": percentile(times, 50),
+        "p95": percentile(times, 95),
+        "p99": percentile(times, 99),
+        "runs": len(times),
+        "throughput": len(times) / sum(times),
+    }
+
+def generate_statistics(contenders: Dict[str, Dict[str, List[float]]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Generate statistical summary of the timing results of each contender
+    (SQL first), with tail latencies and throughput.
+    """
+    stats = {name: {} for name in contenders}
 
-def generate_statistics(num_runs: int) -> Dict[str, Dict[str, Dict[str, float]]]:
-    """Generate statistical summary of timing results."""
-    stats = {"SQL": {}, "NoSQL": {}}
-
-    for query_name in sql_times.keys():
-        sql_query_times = sql_times[query_name]
-        nosql_query_times = nosql_times.get(query_name, [])
-
-        if sql_query_times and nosql_query_times:
-            stats["SQL"][query_name] = {
-                "mean": statistics.mean(sql_query_times),
-                "median": statistics.median(sql_query_times),
-                "std_dev": statistics.stdev(sql_query_times) if len(sql_query_times) > 1 else 0,
-                "min": min(sql_query_times),
-                "max": max(sql_query_times)
-            }
-
-            stats["NoSQL"][query_name] = {
-                "mean": statistics.mean(nosql_query_times),
-                "median": statistics.median(nosql_query_times),
-                "std_dev": statistics.stdev(nosql_query_times) if len(nosql_query_times) > 1 else 0,
-                "min": min(nosql_query_times),
-                "max": max(nosql_query_times)
-            }
+    for query_name in contenders["SQL"].keys():
+        if not all(times.get(query_name) for times in contenders.values()):
+            continue
+
+        for name, times in contenders.items():
+            stats[name][query_name] = summarize_times(times[query_name])
 
     return stats
 
@@ -142,20 +691,16 @@ def plot_comparison(stats: Dict[str, Dict[str, Dict[str, float]]]):
 
     operations = list(stats["SQL"].keys())
     x = range(len(operations))
-    width = 0.35
-
-    sql_means = [stats["SQL"][op]["mean"] for op in operations]
-    nosql_means = [stats["NoSQL"][op]["mean"] for op in operations]
-
-    plt.bar([i - width / 2 for i in x], sql_means, width, label='SQL', color='skyblue')
-    plt.bar([i + width / 2 for i in x], nosql_means, width, label='NoSQL', color='lightcoral')
+    width = 0.7 / len(stats)
+    colors = ['skyblue', 'lightcoral', 'lightgreen', 'plum', 'khaki']
 
-    plt.errorbar([i - width / 2 for i in x], sql_means,
-                 yerr=[stats["SQL"][op]["std_dev"] for op in operations],
-                 fmt='none', ecolor='black', capsize=5)
-    plt.errorbar([i + width / 2 for i in x], nosql_means,
-                 yerr=[stats["NoSQL"][op]["std_dev"] for op in operations],
-                 fmt='none', ecolor='black', capsize=5)
+    for position, (name, contender_stats) in enumerate(stats.items()):
+        offset = (position - (len(stats) - 1) / 2) * width
+        means = [contender_stats[op]["mean"] for op in operations]
+        plt.bar([i + offset for i in x], means, width, label=name, color=colors[position % len(colors)])
+        plt.errorbar([i + offset for i in x], means,
+                     yerr=[contender_stats[op]["std_dev"] for op in operations],
+                     fmt='none', ecolor='black', capsize=5)
 
     plt.xlabel('Operation Type')
     plt.ylabel('Execution Time (seconds)')
@@ -167,49 +712,312 @@ def plot_comparison(stats: Dict[str, Dict[str, Dict[str, float]]]):
     plt.savefig('performance_comparison.png')
     plt.close()
 
-def print_statistics(stats: Dict[str, Dict[str, Dict[str, float]]]):
+def print_statistics(stats: Dict[str, Dict[str, Dict[str, float]]], row_counts: Dict[str, int]):
     """Print formatted statistics."""
     print("\nPerformance Statistics:")
     print("=" * 80)
 
     for operation in stats["SQL"].keys():
-        print(f"\nOperation: {operation}")
+        print(f"\nOperation: {operation} ({row_counts.get(operation, '?')} SQL rows)")
         print("-" * 40)
 
-        sql_stats = stats["SQL"][operation]
-        nosql_stats = stats["NoSQL"][operation]
-
-        print(f"SQL Implementation:")
-        print(f"  Mean: {sql_stats['mean']:.6f} seconds")
-        print(f"  Median: {sql_stats['median']:.6f} seconds")
-        print(f"  Std Dev: {sql_stats['std_dev']:.6f} seconds")
-        print(f"  Range: {sql_stats['min']:.6f} - {sql_stats['max']:.6f} seconds")
+        for name, contender_stats in stats.items():
+            operation_stats = contender_stats[operation]
+            print(f"\n{name} Implementation:")
+            print(f"  Mean: {operation_stats['mean']:.6f} seconds")
+            print(f"  Median: {operation_stats['median']:.6f} seconds")
+            print(f"  Std Dev: {operation_stats['std_dev']:.6f} seconds")
+            print(f"  Range: {operation_stats['min']:.6f} - {operation_stats['max']:.6f} seconds")
+            print(f"  p50 / p95 / p99: {operation_stats['p50']:.6f} / {operation_stats['p95']:.6f} / "
+                  f"{operation_stats['p99']:.6f} seconds")
+            print(f"  Throughput: {operation_stats['throughput']:.1f} operations per second "
+                  f"({operation_stats['runs']} runs)")
 
-        print(f"\nNoSQL Implementation:")
-        print(f"  Mean: {nosql_stats['mean']:.6f} seconds")
-        print(f"  Median: {nosql_stats['median']:.6f} seconds")
-        print(f"  Std Dev: {nosql_stats['std_dev']:.6f} seconds")
-        print(f"  Range: {nosql_stats['min']:.6f} - {nosql_stats['max']:.6f} seconds")
+        sql_stats = stats["SQL"][operation]
+        for name, contender_stats in stats.items():
+            if name == "SQL":
+                continue
+            diff_percent = ((contender_stats[operation]['mean'] - sql_stats['mean']) / sql_stats['mean']) * 100
+            faster = "SQL" if diff_percent > 0 else name
+            print(f"\nPerformance Difference ({name}): {abs(diff_percent):.2f}% faster with {faster}")
+
+def benchmark_queries(args, settings: RunSettings) -> (Dict[str, Dict[str, Dict[str, float]]], Dict[str, int]):
+    """
+    Time every contender on the open databases and summarize the timings.
+    Returns the statistics and the number of rows of each SQL query.
+    """
+    if args.indexes:
+        importlib.import_module("04_NoSQLManip").enable_indexes(nosql_db)
+
+    contenders = {
+        "SQL": time_sql_queries(settings, args.sql_fetch),
+        "NoSQL": time_nosql_queries(settings, args.nosql_mode),
+    }
+    if args.columnar:
+        contenders["NoSQL (columnar)"] = time_columnar_queries(settings)
+    if args.relational:
+        contenders["NoSQL (relational)"] = time_relational_queries(settings)
+
+    return generate_statistics(contenders), count_sql_rows()
+
+def sweep_scale_factors(args, scale_factors: List[float],
+                        settings: RunSettings) -> Dict[float, Dict[str, Dict[str, Dict[str, float]]]]:
+    """
+    Benchmark the queries on generated databases of several scale factors.
+    Returns the statistics and the SQL row counts of each scale factor.
+    """
+    sweep_stats = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale_factor in scale_factors:
+            sql_path, nosql_path, relational_path = create_scaled_stores(directory, scale_factor, args.storage)
+            initialize_databases(sql_path, nosql_path, args.storage, relational_path if args.relational else None)
+            sweep_stats[scale_factor] = benchmark_queries(args, settings)
+            print(f"\nScale factor: {scale_factor:g}")
+            print_statistics(*sweep_stats[scale_factor])
+            close_databases()
+
+    return sweep_stats
+
+# Fields of the records written by write_results
+RECORD_FIELDS = ["scale_factor", "contender", "operation", "rows", "mean", "median", "std_dev", "min", "max",
+                 "p50", "p95", "p99", "runs", "throughput"]
+
+def statistics_records(stats: Dict[str, Dict[str, Dict[str, float]]], row_counts: Dict[str, int],
+                       scale_factor: float = None) -> List[Dict]:
+    """Flatten the statistics into one record per contender and operation."""
+    return [
+        {"scale_factor": scale_factor, "contender": name, "operation": operation,
+         "rows": row_counts.get(operation), **operation_stats}
+        for name, contender_stats in stats.items()
+        for operation, operation_stats in contender_stats.items()
+    ]
+
+def write_results(records: List[Dict], path: str, settings: Dict):
+    """
+    Write the records as CSV, or as JSON together with the benchmark settings.
+    Without records, the CSV file only has the header of the record fields.
+    """
+    with open(path, "w", newline="") as file:
+        if path.endswith(".csv"):
+            fieldnames = list(records[0]) if records else RECORD_FIELDS
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump({"settings": settings, "results": records}, file, indent=2)
+
+def compare_with_baseline(records: List[Dict], baseline_path: str, threshold: float) -> List[Dict]:
+    """
+    Compare the median latency of every record with the same record of a JSON
+    baseline written by --output. Slower by more than threshold is a regression.
+    """
+    with open(baseline_path) as file:
+        baseline = {
+            (record["scale_factor"], record["contender"], record["operation"]): record
+            for record in json.load(file)["results"]
+        }
+
+    comparisons = []
+    for record in records:
+        baseline_record = baseline.get((record["scale_factor"], record["contender"], record["operation"]))
+        if baseline_record is None:
+            continue
+        change = record["p50"] / baseline_record["p50"] - 1
+        comparisons.append({
+            "scale_factor": record["scale_factor"],
+            "contender": record["contender"],
+            "operation": record["operation"],
+            "baseline": baseline_record["p50"],
+            "current": record["p50"],
+            "change": change,
+            "regression": change > threshold,
+        })
+    return comparisons
+
+def print_baseline_comparison(comparisons: List[Dict]):
+    """Print the median latency change of every operation against the baseline."""
+    print("\nBaseline Comparison (p50):")
+    print("=" * 80)
 
-        diff_percent = ((nosql_stats['mean'] - sql_stats['mean']) / sql_stats['mean']) * 100
-        faster = "SQL" if diff_percent > 0 else "NoSQL"
-        print(f"\nPerformance Difference: {abs(diff_percent):.2f}% faster with {faster}")
+    for comparison in comparisons:
+        dataset = "data" if comparison["scale_factor"] is None else f"SF {comparison['scale_factor']:g}"
+        flag = "  REGRESSION" if comparison["regression"] else ""
+        print(f"  [{dataset}] {comparison['contender']} / {comparison['operation']}: "
+              f"{comparison['baseline']:.6f} -> {comparison['current']:.6f} seconds "
+              f"({comparison['change']:+.1%}){flag}")
+
+    regressions = sum(comparison["regression"] for comparison in comparisons)
+    print(f"\n{regressions} regression(s) out of {len(comparisons)} compared operations")
+
+def parse_args():
+    nosql_init = importlib.import_module("02_NoSQL_init")
+    parser = argparse.ArgumentParser(description="Benchmark the SQL and NoSQL implementations.")
+    parser.add_argument("--conversion", type=float, nargs="+", metavar="SCALE_FACTOR",
+                        help="Time the DuckDB to TinyDB conversions at these scale factors instead")
+    parser.add_argument("--relational-conversion", type=float, nargs="+", metavar="SCALE_FACTOR",
+                        help="Compare wall time and peak memory of the pandas and Arrow relational conversions instead")
+    parser.add_argument("--conversion-run", nargs=2, metavar=("SQL_PATH", "ENGINE"),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--compare-storage", action="store_true",
+                        help="Compare file size and load time of the TinyDB stores for each storage backend instead")
+    parser.add_argument("--fetch-modes", action="store_true",
+                        help="Time the SQL queries with every fetch mode instead")
+    parser.add_argument("--sql-fetch", choices=list(FETCH_MODES), default="fetchall",
+                        help="How the SQL results are fetched when timing the SQL queries")
+    parser.add_argument("--layout", type=float, nargs="+", metavar="SCALE_FACTOR",
+                        help="Compare the date and product lookups on the default and optimized layouts instead")
+    parser.add_argument("--shared-readers", type=int, nargs="+", metavar="READERS",
+                        help="Load test the shared TinyDB store with these numbers of reader threads instead")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds each shared store load level lasts")
+    parser.add_argument("--write-interval", type=float, default=0.05,
+                        help="Seconds between two writes during the shared store load test")
+    parser.add_argument("--lookups", type=int, metavar="N",
+                        help="Time N daily sales lookups one query at a time and as one batched query instead")
+    parser.add_argument("--storage", choices=list(nosql_init.STORAGES), default="json",
+                        help="TinyDB storage backend of the NoSQL database")
+    parser.add_argument("--indexes", action="store_true",
+                        help="Let the NoSQL operations use secondary indexes built before timing")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Add the document store with a columnar NumPy cache as a contender")
+    parser.add_argument("--relational", action="store_true",
+                        help="Add the relational TinyDB store queried with hash joins as a contender")
+    parser.add_argument("--nosql-mode", choices=["cold", "warm"], default="cold",
+                        help="Re-read the NoSQL store on every operation (cold) or use a cached snapshot (warm)")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Time opening, loading, a first query and closing of each engine instead")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="Run every cold start in a fresh interpreter")
+    parser.add_argument("--cold-run", nargs=2, metavar=("SQL_PATH", "NOSQL_PATH"),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--runs", type=int, default=100,
+                        help="Timed runs per operation, or the minimum number of runs with --until-stable")
+    parser.add_argument("--warmup", type=int, default=5,
+                        help="Untimed runs per operation before timing")
+    parser.add_argument("--until-stable", type=float, metavar="REL_ERROR",
+                        help="Keep timing until the standard error of the mean is within this fraction of the mean")
+    parser.add_argument("--max-runs", type=int, default=1000,
+                        help="Upper bound on the runs per operation with --until-stable")
+    parser.add_argument("--scale-factors", type=float, nargs="+", metavar="SCALE_FACTOR",
+                        help="Benchmark the queries on generated databases of these scale factors")
+    parser.add_argument("--output", metavar="PATH",
+                        help="Write the statistics to this file, as CSV for a .csv path and as JSON otherwise")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="Compare the median latencies with a JSON file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative slowdown against the baseline reported as a regression")
+    return parser.parse_args()
 
 def main():
-    print("Starting performance benchmark...")
+    args = parse_args()
+    settings = RunSettings(args.runs, args.warmup, args.until_stable, args.max_runs)
+    extension = importlib.import_module("02_NoSQL_init").STORAGES[args.storage][1]
+
+    if args.conversion_run:
+        # Single relational conversion requested by compare_relational_conversions
+        print(json.dumps(relational_conversion_run(*args.conversion_run)))
+        return
+
+    if args.relational_conversion:
+        print("Starting relational conversion benchmark...")
+        print_relational_conversions(compare_relational_conversions(args.relational_conversion))
+        print("\nBenchmark complete!")
+        return
+
+    if args.conversion:
+        print("Starting conversion benchmark...")
+        print_conversion_times(time_conversions(args.conversion))
+        print("\nBenchmark complete!")
+        return
+
+    if args.layout:
+        print("Starting layout benchmark...")
+        print_layout_comparison(compare_layouts(args.layout, settings))
+        print("\nBenchmark complete!")
+        return
+
+    if args.shared_readers:
+        print("Starting shared store benchmark...")
+        nosql_path = f"data/hierarchical_tinydb_shop{extension}"
+        print_shared_store_load([
+            shared_store_load(nosql_path, num_readers, args.duration, args.write_interval, args.storage)
+            for num_readers in args.shared_readers
+        ])
+        print("\nBenchmark complete!")
+        return
+
+    if args.cold_run:
+        # Single cold start requested by cold_start_in_subprocess
+        print(json.dumps(cold_start_phases(*args.cold_run, args.storage)))
+        return
+
+    if args.compare_storage:
+        print("Starting storage benchmark...")
+        print_storage_comparison(compare_storages(
+            ["data/hierarchical_tinydb_shop.json", "data/relational_tinydb_shop.json"]))
+        print("\nBenchmark complete!")
+        return
+
+    if args.cold_start:
+        print("Starting cold start benchmark...")
+        cold_stats = {}
+        with tempfile.TemporaryDirectory() as directory:
+            if args.scale_factors:
+                datasets = {f"SF {scale_factor:g}": create_scaled_stores(directory, scale_factor, args.storage)
+                            for scale_factor in args.scale_factors}
+            else:
+                nosql_path = f"data/hierarchical_tinydb_shop{extension}"
+                datasets = {"data": ("data/duckdb_shop.db", nosql_path)}
+            for dataset, (sql_path, nosql_path, *_) in datasets.items():
+                cold_stats[dataset] = time_cold_starts(sql_path, nosql_path, args.storage, args.runs,
+                                                       args.subprocess)
+        print_cold_starts(cold_stats)
+        print("\nBenchmark complete!")
+        return
 
-    initialize_databases("data/duckdb_shop.db", "data/tinydb_shop.json")
-
-    num_runs = 100
-    time_sql_queries(num_runs)
-    time_nosql_queries(num_runs)
+    print("Starting performance benchmark...")
 
-    stats = generate_statistics(num_runs)
-    print_statistics(stats)
-    plot_comparison(stats)
+    if args.scale_factors:
+        sweep_stats = sweep_scale_factors(args, args.scale_factors, settings)
+        records = [record for scale_factor, (stats, row_counts) in sweep_stats.items()
+                   for record in statistics_records(stats, row_counts, scale_factor)]
+    else:
+        nosql_path = f"data/hierarchical_tinydb_shop{extension}"
+        relational_path = f"data/relational_tinydb_shop{extension}"
+        initialize_databases("data/duckdb_shop.db", nosql_path, args.storage,
+                             relational_path if args.relational else None)
+
+        if args.fetch_modes:
+            print_fetch_statistics(time_fetch_modes(settings), count_sql_rows())
+            close_databases()
+            print("\nBenchmark complete!")
+            return
+
+        if args.lookups:
+            print_lookup_times(time_daily_lookups(args.lookups), args.lookups)
+            close_databases()
+            print("\nBenchmark complete!")
+            return
+
+        stats, row_counts = benchmark_queries(args, settings)
+        print_statistics(stats, row_counts)
+        plot_comparison(stats)
+        close_databases()
+        records = statistics_records(stats, row_counts)
+
+    if args.output:
+        write_results(records, args.output,
+                      {key: value for key, value in vars(args).items() if key not in ("output", "baseline")})
+
+    regressions = 0
+    if args.baseline:
+        comparisons = compare_with_baseline(records, args.baseline, args.threshold)
+        print_baseline_comparison(comparisons)
+        regressions = sum(comparison["regression"] for comparison in comparisons)
 
-    close_databases()
     print("\nBenchmark complete!")
+    if regressions:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
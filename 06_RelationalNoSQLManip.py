@@ -0,0 +1,319 @@
+import argparse
+import importlib
+from collections import defaultdict
+import pyarrow as pa
+import pyarrow.compute as pc
+
+nosql_manip = importlib.import_module("04_NoSQLManip")
+
+
+def read_tables(db) -> dict:
+    """
+    Read every table of the relational TinyDB store in one pass over the file,
+    as lists of records carrying their DuckDB id.
+    """
+    return {
+        table_name: [{**record, 'id': int(record_id)} for record_id, record in records.items()]
+        for table_name, records in (db.storage.read() or {}).items()
+    }
+
+
+def hash_join(probe_rows, probe_key, build_records, build_key, outer: bool = False):
+    """
+    Equi-join rows (tuples of records) with a table: build a hash table on the
+    build side, then probe it once per row and append the matching record.
+    With outer, rows without a match are kept with None, as in a LEFT JOIN.
+    """
+    hash_table = defaultdict(list)
+    for record in build_records:
+        hash_table[build_key(record)].append(record)
+
+    for row in probe_rows:
+        matches = hash_table.get(probe_key(row))
+        if matches:
+            for match in matches:
+                yield row + (match,)
+        elif outer:
+            yield row + (None,)
+
+
+def hash_aggregate(rows, group_key, value) -> dict:
+    """Sum a value per group key in a hash table, as in GROUP BY ... SUM(...)."""
+    totals = defaultdict(int)
+    for row in rows:
+        totals[group_key(row)] += value(row)
+    return dict(totals)
+
+
+def scan(records, predicate=None):
+    """Rows of a single table, filtered by a predicate pushed down to the scan."""
+    return ((record,) for record in records if predicate is None or predicate(record))
+
+
+def is_arrow(db) -> bool:
+    """
+    Whether db is the dict of memory-mapped Arrow tables of
+    02_NoSQL_init.read_relational_arrow. The analyses then filter, join and
+    aggregate Sales and SaleDetails with Arrow compute on the mapped buffers,
+    and only turn the small Categories and Products tables and the rows left
+    after filtering into Python records.
+    """
+    return isinstance(db, dict)
+
+
+def arrow_product_quantities(tables) -> dict:
+    """Quantity sold per product id, as GROUP BY product_id on SaleDetails."""
+    grouped = tables['SaleDetails'].group_by('product_id').aggregate([('quantity', 'sum')])
+    return dict(zip(grouped['product_id'].to_pylist(), grouped['quantity_sum'].to_pylist()))
+
+
+def arrow_filtered_records(table, mask) -> list:
+    """Records of the rows of an Arrow table selected by a boolean mask."""
+    return table.filter(mask).to_pylist()
+
+
+def get_total_sales_by_category(db, quiet: bool = False) -> dict:
+    """
+    Equivalent to SQL:
+    SELECT SUM(sd.quantity) AS total_quantity, cat.name AS category
+    FROM SaleDetails sd
+    LEFT JOIN Products pr ON sd.product_id = pr.id
+    LEFT JOIN Categories cat ON pr.category_id = cat.id
+    GROUP BY category
+    """
+    if is_arrow(db):
+        # Aggregated per product in Arrow first, then joined with the small tables
+        category_names = {category['id']: category['name'] for category in db['Categories'].to_pylist()}
+        product_categories = {product['id']: category_names.get(product['category_id'])
+                              for product in db['Products'].to_pylist()}
+        category_totals = hash_aggregate(arrow_product_quantities(db).items(),
+                                         lambda item: product_categories.get(item[0]), lambda item: item[1])
+    else:
+        tables = read_tables(db)
+
+        # (sale detail, product, category)
+        rows = hash_join(scan(tables['SaleDetails']), lambda row: row[0]['product_id'],
+                         tables['Products'], lambda product: product['id'], outer=True)
+        rows = hash_join(rows, lambda row: row[1] and row[1]['category_id'],
+                         tables['Categories'], lambda category: category['id'], outer=True)
+        category_totals = hash_aggregate(rows, lambda row: row[2] and row[2]['name'], lambda row: row[0]['quantity'])
+
+    if not quiet:
+        nosql_manip.print_total_sales_by_category(category_totals)
+    return category_totals
+
+
+def get_total_price_by_product(db, quiet: bool = False) -> list:
+    """
+    Equivalent to SQL:
+    SELECT pd.name AS name, pd.price AS unit_price,
+           COALESCE(SUM(sd.quantity), 0) AS total_saled,
+           pd.price * total_saled AS total_earned
+    FROM Products pd
+    LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
+    GROUP BY name, pd.price
+    ORDER BY total_earned DESC
+    """
+    if is_arrow(db):
+        product_quantities = arrow_product_quantities(db)
+        quantities = hash_aggregate(scan(db['Products'].to_pylist()), lambda row: (row[0]['name'], row[0]['price']),
+                                    lambda row: product_quantities.get(row[0]['id'], 0))
+    else:
+        tables = read_tables(db)
+
+        # (product, sale detail)
+        rows = hash_join(scan(tables['Products']), lambda row: row[0]['id'],
+                         tables['SaleDetails'], lambda sale_detail: sale_detail['product_id'], outer=True)
+        quantities = hash_aggregate(rows, lambda row: (row[0]['name'], row[0]['price']),
+                                    lambda row: row[1]['quantity'] if row[1] else 0)
+
+    product_totals = [
+        {'name': name, 'unit_price': unit_price, 'total_saled': quantity, 'total_earned': unit_price * quantity}
+        for (name, unit_price), quantity in quantities.items()
+    ]
+    product_totals.sort(key=lambda x: x['total_earned'], reverse=True)
+
+    if not quiet:
+        nosql_manip.print_total_price_by_product(product_totals)
+    return product_totals
+
+
+def get_sales_by_date(db, target_date: str, quiet: bool = False) -> list:
+    """
+    Equivalent to SQL:
+    SELECT cat.name AS category, pd.name AS name, pd.price AS unit_price,
+           sd.quantity AS quantity, pd.price * sd.quantity AS total_price,
+           sl.date AS date
+    FROM Categories cat
+    LEFT JOIN Products pd ON (cat.id = pd.category_id)
+    LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
+    LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
+    WHERE sl.date = target_date
+    """
+    if is_arrow(db):
+        # Both filters run in Arrow, leaving only the sales of the day and their details
+        sales = arrow_filtered_records(db['Sales'], pc.equal(db['Sales']['date'], target_date))
+        sale_ids = pa.array([sale['id'] for sale in sales], pa.int64())
+        tables = {
+            'Sales': sales,
+            'SaleDetails': arrow_filtered_records(db['SaleDetails'], pc.is_in(db['SaleDetails']['sale_id'], sale_ids)),
+            'Products': db['Products'].to_pylist(),
+            'Categories': db['Categories'].to_pylist(),
+        }
+    else:
+        tables = read_tables(db)
+
+    # The date filter turns the outer joins into inner joins, so start from the matching sales
+    rows = scan(tables['Sales'], lambda sale: sale['date'] == target_date)
+    # (sale, sale detail, product, category)
+    rows = hash_join(rows, lambda row: row[0]['id'],
+                     tables['SaleDetails'], lambda sale_detail: sale_detail['sale_id'])
+    rows = hash_join(rows, lambda row: row[1]['product_id'], tables['Products'], lambda product: product['id'])
+    rows = hash_join(rows, lambda row: row[2]['category_id'], tables['Categories'], lambda category: category['id'])
+
+    daily_sales = [
+        {
+            'category': category['name'],
+            'product': product['name'],
+            'unit_price': product['price'],
+            'quantity': sale_detail['quantity'],
+            'total_price': product['price'] * sale_detail['quantity'],
+            'date': target_date
+        }
+        for sale, sale_detail, product, category in rows
+    ]
+    daily_sales.sort(key=lambda x: (x['category'], -x['total_price']))
+
+    if not quiet:
+        nosql_manip.print_sales_by_date(target_date, daily_sales)
+    return daily_sales
+
+
+def get_product_sales_by_month(db, product_name: str, year: int, month: int, quiet: bool = False) -> list:
+    """
+    Equivalent to SQL:
+    SELECT pd.name, pd.price AS unit_price, sd.quantity,
+           pd.price * sd.quantity AS total_price, sl.date
+    FROM Products pd
+    LEFT JOIN SaleDetails sd ON (pd.id = sd.product_id)
+    LEFT JOIN Sales sl ON (sd.sale_id = sl.id)
+    WHERE pd.name = product_name AND sl.date BETWEEN start_date AND end_date
+    """
+    month_prefix = f"{year:04d}-{month:02d}-"
+    if is_arrow(db):
+        # Both filters run in Arrow, leaving only the product's details and the sales of the month
+        products = db['Products'].to_pylist()
+        product_ids = pa.array([product['id'] for product in products if product['name'] == product_name], pa.int64())
+        tables = {
+            'Products': products,
+            'SaleDetails': arrow_filtered_records(db['SaleDetails'],
+                                                  pc.is_in(db['SaleDetails']['product_id'], product_ids)),
+            'Sales': arrow_filtered_records(db['Sales'], pc.starts_with(db['Sales']['date'], month_prefix)),
+        }
+    else:
+        tables = read_tables(db)
+
+    # (product, sale detail, sale), with both filters pushed down to their scans
+    rows = scan(tables['Products'], lambda product: product['name'] == product_name)
+    rows = hash_join(rows, lambda row: row[0]['id'],
+                     tables['SaleDetails'], lambda sale_detail: sale_detail['product_id'])
+    rows = hash_join(rows, lambda row: row[1]['sale_id'],
+                     [sale for sale in tables['Sales'] if sale['date'].startswith(month_prefix)],
+                     lambda sale: sale['id'])
+
+    monthly_sales = [
+        {
+            'date': sale['date'],
+            'quantity': sale_detail['quantity'],
+            'unit_price': product['price'],
+            'total_price': product['price'] * sale_detail['quantity']
+        }
+        for product, sale_detail, sale in rows
+    ]
+    monthly_sales.sort(key=lambda x: x['date'])
+
+    if not quiet:
+        nosql_manip.print_product_sales_by_month(product_name, year, month, monthly_sales)
+    return monthly_sales
+
+
+def get_hierarchical_sales_summary(db, quiet: bool = False) -> dict:
+    """
+    Shows total quantities sold for each product and category
+    Equivalent to SQL UNION query:
+    SELECT cat.name AS Type, COALESCE(SUM(sd.quantity), 0) AS Quantity
+    FROM Categories cat
+    LEFT JOIN Products pd ON cat.id = pd.category_id
+    LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
+    GROUP BY Type
+    UNION
+    SELECT pd.name AS Type, COALESCE(SUM(sd.quantity), 0) AS Quantity
+    FROM Products pd
+    LEFT JOIN SaleDetails sd ON pd.id = sd.product_id
+    GROUP BY Type
+    ORDER BY Quantity DESC, Type
+    """
+    if is_arrow(db):
+        # (category, product), with the quantities aggregated per product in Arrow
+        product_quantities = arrow_product_quantities(db)
+        rows = hash_join(scan(db['Categories'].to_pylist()), lambda row: row[0]['id'],
+                         db['Products'].to_pylist(), lambda product: product['category_id'], outer=True)
+        product_totals = hash_aggregate(rows, lambda row: (row[0]['name'], row[1] and row[1]['name']),
+                                        lambda row: product_quantities.get(row[1]['id'], 0) if row[1] else 0)
+    else:
+        tables = read_tables(db)
+
+        # (category, product, sale detail), aggregated once per product then rolled up per category
+        rows = hash_join(scan(tables['Categories']), lambda row: row[0]['id'],
+                         tables['Products'], lambda product: product['category_id'], outer=True)
+        rows = hash_join(rows, lambda row: row[1] and row[1]['id'],
+                         tables['SaleDetails'], lambda sale_detail: sale_detail['product_id'], outer=True)
+        product_totals = hash_aggregate(rows, lambda row: (row[0]['name'], row[1] and row[1]['name']),
+                                        lambda row: row[2]['quantity'] if row[2] else 0)
+
+    category_totals = hash_aggregate(product_totals.items(), lambda item: item[0][0], lambda item: item[1])
+    summary = {
+        'categories': category_totals,
+        'products': sorted(((product_name, quantity) for (category_name, product_name), quantity
+                            in product_totals.items() if product_name is not None),
+                           key=lambda x: (-x[1], x[0])),
+    }
+    if not quiet:
+        nosql_manip.print_hierarchical_sales_summary(summary)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the NoSQL analyses on the relational store with hash joins.")
+    parser.add_argument("--path", default="data/relational_tinydb_shop.json",
+                        help="Relational TinyDB store written by 02_NoSQL_init")
+    parser.add_argument("--storage", choices=list(nosql_manip.nosql_init.STORAGES), default="json",
+                        help="TinyDB storage backend of the relational store")
+    parser.add_argument("--arrow", metavar="DIRECTORY",
+                        help="Read the memory-mapped Arrow IPC files of 02_NoSQL_init --arrow-ipc instead")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Connect to the relational TinyDB store, or map its Arrow export
+    if args.arrow:
+        db = nosql_manip.nosql_init.read_relational_arrow(args.arrow)
+    else:
+        db = nosql_manip.nosql_init.open_tinydb(args.path, args.storage)
+
+    # Run all our analysis functions
+    get_total_sales_by_category(db)
+    get_total_price_by_product(db)
+    get_sales_by_date(db, '2024-08-10')
+    get_product_sales_by_month(db, 'Laptop', 2024, 8)
+    get_hierarchical_sales_summary(db)
+
+    # Close the connection
+    if not args.arrow:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
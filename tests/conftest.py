@@ -0,0 +1,26 @@
+import shutil
+import importlib
+import pytest
+
+sql_init = importlib.import_module("01_SQL_init")
+
+# Small seeded shop shared by the tests: 100 sales, 400 sale details
+SCALE_FACTOR = 0.2
+SEED = 7
+
+
+@pytest.fixture(scope="session")
+def shop_db(tmp_path_factory) -> str:
+    """Path of the seeded DuckDB shop database, only to be opened read-only."""
+    path = str(tmp_path_factory.mktemp("shop") / "duckdb_shop.db")
+    sql_init.init_db(path)
+    sql_init.bulk_fill_db(path, SCALE_FACTOR, SEED)
+    return path
+
+
+@pytest.fixture
+def writable_shop_db(shop_db, tmp_path) -> str:
+    """Private copy of the seeded shop database for tests that write to it."""
+    path = str(tmp_path / "duckdb_shop.db")
+    shutil.copyfile(shop_db, path)
+    return path
@@ -0,0 +1,96 @@
+import importlib
+import duckdb
+import numpy as np
+
+from conftest import SCALE_FACTOR, SEED
+
+sql_init = importlib.import_module("01_SQL_init")
+
+
+def table_rows(path: str, table_name: str) -> list:
+    con = duckdb.connect(path, read_only=True)
+    rows = con.execute(f"SELECT * FROM {table_name} ORDER BY id").fetchall()
+    con.close()
+    return rows
+
+
+def test_bulk_fill_is_reproducible_for_a_seed(shop_db, tmp_path):
+    path = str(tmp_path / "again.db")
+    sql_init.init_db(path)
+    sql_init.bulk_fill_db(path, SCALE_FACTOR, SEED)
+    for table_name in sql_init.TABLES:
+        assert table_rows(path, table_name) == table_rows(shop_db, table_name)
+
+
+def test_bulk_fill_matches_the_fill_db_shape(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    num_sales, num_details = sql_init.scaled_counts(SCALE_FACTOR)
+    assert con.execute("SELECT COUNT(*) FROM Sales").fetchone()[0] == num_sales
+    assert con.execute("SELECT COUNT(*) FROM SaleDetails").fetchone()[0] == num_details
+
+    # Every sale has a ticket line, sale ids follow the dates, quantities are 1 to 5
+    assert con.execute("""
+        SELECT COUNT(*) FROM Sales sl
+        WHERE NOT EXISTS (SELECT 1 FROM SaleDetails sd WHERE sd.sale_id = sl.id)
+    """).fetchone()[0] == 0
+    dates = [row[0] for row in con.execute("SELECT date FROM Sales ORDER BY id").fetchall()]
+    assert dates == sorted(dates)
+    assert con.execute("SELECT MIN(quantity), MAX(quantity) <= 5 FROM SaleDetails").fetchone() == (1, True)
+    con.close()
+
+
+def test_fill_paths_bump_table_versions(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    assert dict(con.execute("SELECT name, version FROM TableVersions").fetchall()) == {
+        table_name: 1 for table_name in sql_init.TABLES
+    }
+    con.close()
+
+
+def test_ids_are_64_bit(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    column_types = dict(con.execute("""
+        SELECT table_name || '.' || column_name, data_type FROM information_schema.columns
+        WHERE column_name = 'id' OR column_name LIKE '%\\_id' ESCAPE '\\'
+    """).fetchall())
+    con.close()
+    assert set(column_types.values()) == {"BIGINT"}
+
+    # Sale ids past the 32-bit range keep their value
+    first_sale = 3_000_000_000
+    sales, sale_details = sql_init.generate_sales_chunk(
+        np.random.default_rng(SEED), first_sale, first_sale + 9, 5, 5_000_000_000, np.array([first_sale + 9]))
+    assert sales["id"].iloc[0] == first_sale
+    assert sale_details["sale_id"].min() == first_sale
+    assert sale_details["id"].iloc[-1] == 5_000_000_000 + 14
+
+
+def test_parallel_fill_does_not_depend_on_the_workers(tmp_path):
+    paths = []
+    for workers in (1, 2):
+        path = str(tmp_path / f"parallel_{workers}.db")
+        sql_init.init_db(path)
+        sql_init.parallel_fill_db(path, SCALE_FACTOR, SEED, workers, chunk_size=30,
+                                  parquet_dir=str(tmp_path / f"parquet_{workers}"))
+        paths.append(path)
+
+    num_sales, num_details = sql_init.scaled_counts(SCALE_FACTOR)
+    assert len(table_rows(paths[0], "Sales")) == num_sales
+    assert len(table_rows(paths[0], "SaleDetails")) == num_details
+    for table_name in sql_init.TABLES:
+        assert table_rows(paths[0], table_name) == table_rows(paths[1], table_name)
+
+
+def test_optimize_layout_only_reorders_sale_details(shop_db, writable_shop_db):
+    sql_init.optimize_layout(writable_shop_db)
+    for table_name in sql_init.TABLES:
+        assert table_rows(writable_shop_db, table_name) == table_rows(shop_db, table_name)
+
+    con = duckdb.connect(writable_shop_db, read_only=True)
+    versions = dict(con.execute("SELECT name, version FROM TableVersions").fetchall())
+    months = [row[0] for row in con.execute("""
+        SELECT date_trunc('month', sl.date) FROM SaleDetails sd JOIN Sales sl ON sd.sale_id = sl.id
+    """).fetchall()]
+    con.close()
+    assert versions == {"Categories": 1, "Products": 1, "Sales": 1, "SaleDetails": 2}
+    assert months == sorted(months)
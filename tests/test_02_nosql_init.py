@@ -0,0 +1,222 @@
+import os
+import glob
+import json
+import importlib
+import duckdb
+import pytest
+
+from conftest import SCALE_FACTOR, SEED
+
+sql_init = importlib.import_module("01_SQL_init")
+nosql_init = importlib.import_module("02_NoSQL_init")
+
+
+@pytest.fixture
+def con(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    yield con
+    con.close()
+
+
+def test_hierarchical_document_holds_every_sale_in_date_order(con):
+    document = nosql_init.convert_to_hierarchical_json(con)
+
+    expected = con.execute("""
+        SELECT cat.name, pr.name, pr.description, pr.price, sd.sale_id, strftime(sl.date, '%Y-%m-%d'), sd.quantity
+        FROM SaleDetails sd
+        JOIN Products pr ON sd.product_id = pr.id
+        JOIN Categories cat ON pr.category_id = cat.id
+        JOIN Sales sl ON sd.sale_id = sl.id
+    """).fetchall()
+    rows = []
+    for category_name, products in document["Categories"].items():
+        for product_name, product_data in products.items():
+            sales = list(product_data["sales"].values())
+            assert list(product_data["sales"]) == list(range(1, len(sales) + 1))
+            assert [sale["date"] for sale in sales] == sorted(sale["date"] for sale in sales)
+            rows += [(category_name, product_name, product_data["description"], product_data["price"],
+                      sale["ticket"], sale["date"], sale["quantity"]) for sale in sales]
+    assert sorted(rows) == sorted(expected)
+
+
+def test_duckdb_engine_builds_the_same_document(con):
+    # Compared as JSON text, so key order and sale numbering count too
+    assert json.dumps(nosql_init.convert_to_hierarchical_json_duckdb(con)) == \
+        json.dumps(nosql_init.convert_to_hierarchical_json(con))
+
+
+def test_ndjson_export_holds_the_whole_document(writable_shop_db, tmp_path):
+    con = duckdb.connect(writable_shop_db)
+    con.execute("INSERT INTO Categories VALUES (4, 'Garden', 'Nothing sold here yet')")
+    path = str(tmp_path / "hierarchical_shop.ndjson")
+    nosql_init.export_hierarchical_ndjson(con, path, batch_size=7)
+
+    exported = {"Categories": {}}
+    with open(path) as file:
+        for line in file:
+            product = json.loads(line)
+            category = exported["Categories"].setdefault(product.pop("category"), {})
+            if "product" in product:
+                category[product.pop("product")] = product
+
+    # Sale keys are strings once in JSON, as in the TinyDB file
+    assert exported == json.loads(json.dumps(nosql_init.convert_to_hierarchical_json(con)))
+    assert exported["Categories"]["Garden"] == {}
+    con.close()
+
+
+def read_store(path: str, storage: str = "json") -> dict:
+    db = nosql_init.open_tinydb(path, storage)
+    data = db.storage.read()
+    db.close()
+    return data
+
+
+@pytest.mark.parametrize("mode", ["bulk", "direct"])
+def test_relational_write_modes_match_inserts(con, tmp_path, mode):
+    relational_data = nosql_init.convert_to_relational_json(con)
+    nosql_init.write_relational_tinydb(relational_data, str(tmp_path / "insert.json"), "insert")
+    nosql_init.write_relational_tinydb(relational_data, str(tmp_path / f"{mode}.json"), mode)
+    assert read_store(str(tmp_path / f"{mode}.json")) == read_store(str(tmp_path / "insert.json"))
+
+
+def storage_round_trip(storage: str, data: dict, path: str) -> dict:
+    storage_instance = nosql_init.STORAGES[storage][0](path)
+    storage_instance.write(data)
+    storage_instance.close()
+    storage_instance = nosql_init.STORAGES[storage][0](path)
+    read = storage_instance.read()
+    storage_instance.close()
+    return read
+
+
+def test_binary_storage_reads_back_what_json_storage_does(con, tmp_path):
+    relational_data = nosql_init.convert_to_relational_json(con)
+    documents = [
+        {"_default": {"1": nosql_init.add_rollups(nosql_init.convert_to_hierarchical_json(con))}},
+        {table_name: dict(records) for table_name, records in relational_data.items()},
+        # Dates that do not read back identically stay strings, and non-string keys become strings
+        {"_default": {"1": {
+            "sales": {1: {"date": "10/08/2024"}, 2: {"date": "20240810"}, 3: {"date": "2024-08-10"}},
+            "events": {"date": "2024-W32-6", "when": {"date": 20240810}},
+            "keys": {None: 1, True: 2, 1.5: 3, 7: {"date": "2024-02-29"}},
+        }}},
+        # Maps of empty records, such as an empty document or categories without products
+        {"_default": {"1": {}}},
+        {"_default": {"1": {"Categories": {"Electronics": {}, "Books": {}}}}},
+    ]
+    for index, document in enumerate(documents):
+        expected = storage_round_trip("json", document, str(tmp_path / f"{index}.json"))
+        assert storage_round_trip("binary", document, str(tmp_path / f"{index}.msgpack")) == expected
+
+
+def convert_stores(database, directory) -> (str, str):
+    """Full conversion into hierarchical (with rollups) and relational TinyDB stores, as 02_NoSQL_init does."""
+    hierarchical_path, relational_path = str(directory / "hierarchical.json"), str(directory / "relational.json")
+    db = nosql_init.open_tinydb(hierarchical_path)
+    db.insert(nosql_init.add_rollups(nosql_init.convert_to_hierarchical_json(database)))
+    db.close()
+    nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(database), relational_path)
+    return hierarchical_path, relational_path
+
+
+def test_incremental_sync_matches_a_full_rebuild(writable_shop_db, tmp_path):
+    con = duckdb.connect(writable_shop_db)
+    (tmp_path / "synced").mkdir()
+    (tmp_path / "rebuilt").mkdir()
+    hierarchical_path, relational_path = convert_stores(con, tmp_path / "synced")
+    state = nosql_init.sync_state(con)
+
+    # A new category with a product and no sales, a new product with sales, and a back-dated sale
+    sale_detail_id = state["sale_detail_id"]
+    con.execute("INSERT INTO Categories VALUES (4, 'Garden', 'Outdoor tools')")
+    con.execute("INSERT INTO Products VALUES (998, 'Rake', 'Steel rake', 25.00, 4)")
+    con.execute("INSERT INTO Products VALUES (999, 'Gizmo', 'A new gadget', 42.00, 1)")
+    con.execute("INSERT INTO Sales VALUES (2001, '2024-12-30'), (2002, '2024-03-15')")
+    con.execute(f"""INSERT INTO SaleDetails VALUES
+        ({sale_detail_id + 1}, 2001, 999, 2), ({sale_detail_id + 2}, 2001, 1, 1), ({sale_detail_id + 3}, 2002, 6, 4)""")
+
+    partitions_path = tmp_path / "synced" / "partitions"
+    partitions_path.mkdir()
+    state = nosql_init.sync_tinydb(con, hierarchical_path, relational_path, state, partitions_path=str(partitions_path))
+    assert state == nosql_init.sync_state(con)
+    rebuilt_paths = convert_stores(con, tmp_path / "rebuilt")
+    nosql_init.write_hierarchical_partitions(read_store(rebuilt_paths[0])["_default"]["1"], str(tmp_path / "rebuilt" / "partitions"))
+    con.close()
+    assert read_store(hierarchical_path) == read_store(rebuilt_paths[0])
+    assert read_store(relational_path) == read_store(rebuilt_paths[1])
+    # Partitions left by an earlier --partitioned run follow the sync
+    rebuilt_partitions_path = tmp_path / "rebuilt" / "partitions"
+    with open(partitions_path / "manifest.json") as synced, open(rebuilt_partitions_path / "manifest.json") as rebuilt:
+        assert json.load(synced) == json.load(rebuilt)
+    paths = sorted(glob.glob("*/*.json", root_dir=rebuilt_partitions_path))
+    assert paths and sorted(glob.glob("*/*.json", root_dir=partitions_path)) == paths
+    for path in paths:
+        assert read_store(str(partitions_path / path)) == read_store(str(rebuilt_partitions_path / path))
+    assert read_store(hierarchical_path)["_default"]["1"]["Categories"]["Electronics"]["Gizmo"]["sales"] == {
+        "1": {"ticket": 2001, "date": "2024-12-30", "quantity": 2}
+    }
+
+
+
+def relational_stores(database, directory) -> (dict, dict):
+    """Relational store written through pandas, then by the Arrow JSON writer with small batches."""
+    pandas_path, arrow_path = str(directory / "pandas.json"), str(directory / "arrow.json")
+    nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(database), pandas_path, "direct")
+    nosql_init.write_relational_json_arrow(database, arrow_path, batch_size=64)
+    return read_store(pandas_path), read_store(arrow_path)
+
+
+def test_arrow_json_writer_matches_the_pandas_store(con, tmp_path):
+    pandas_store, arrow_store = relational_stores(con, tmp_path)
+    assert arrow_store == pandas_store
+
+
+def test_arrow_json_writer_keeps_float_prices_and_empty_tables(tmp_path):
+    path = str(tmp_path / "duckdb_shop.db")
+    sql_init.init_db(path)
+    con = duckdb.connect(path)
+    con.execute("INSERT INTO Categories VALUES (1, 'Office', NULL)")
+    con.execute("INSERT INTO Products VALUES (1, 'Pen', 'Blue \"ink\"', 0.1, 1)")
+    pandas_store, arrow_store = relational_stores(con, tmp_path)
+    con.close()
+    assert arrow_store == pandas_store
+    assert arrow_store["Products"]["1"]["price"] == pandas_store["Products"]["1"]["price"] != 0.1
+    assert arrow_store["Sales"] == {}
+
+
+def test_partitions_of_similar_category_names_do_not_collide(tmp_path):
+    sales = {1: {"ticket": 1, "date": "2024-08-10", "quantity": 1}}
+    document = {"Categories": {
+        category_name: {f"{category_name} product": {"description": None, "price": 1.0, "sales": sales}}
+        for category_name in ("Home & Garden", "Home Garden", "home garden")
+    }}
+    nosql_init.write_hierarchical_partitions(document, str(tmp_path))
+    with open(tmp_path / "manifest.json") as file:
+        paths = [partition["path"] for partition in json.load(file)["partitions"]]
+    assert len({os.path.dirname(path).lower() for path in paths}) == 3
+    for category_name, path in zip(document["Categories"], paths):
+        assert read_store(str(tmp_path / path))["_default"]["1"]["Categories"].keys() == {category_name}
+
+
+def test_sync_is_refused_once_the_synced_rows_changed(writable_shop_db, tmp_path):
+    con = duckdb.connect(writable_shop_db)
+    state = nosql_init.sync_state(con)
+    con.execute("INSERT INTO Sales VALUES (2001, '2024-12-30')")
+    assert nosql_init.can_sync(con, state)
+
+    # A regenerated database: same ids, other rows
+    con.execute("UPDATE SaleDetails SET quantity = quantity + 1 WHERE id = (SELECT MIN(id) FROM SaleDetails)")
+    assert not nosql_init.can_sync(con, state)
+    # A mark that went backwards
+    assert not nosql_init.can_sync(con, {**nosql_init.sync_state(con), "sale_id": 3000})
+    con.close()
+
+    # A database generated from another seed
+    other_path = str(tmp_path / "other_seed.db")
+    sql_init.init_db(other_path)
+    sql_init.bulk_fill_db(other_path, SCALE_FACTOR, SEED + 1)
+    con = duckdb.connect(other_path, read_only=True)
+    assert nosql_init.sync_state(con)["sale_id"] == state["sale_id"]
+    assert not nosql_init.can_sync(con, state)
+    con.close()
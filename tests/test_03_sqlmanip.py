@@ -0,0 +1,82 @@
+import importlib
+import duckdb
+import pytest
+
+sql_init = importlib.import_module("01_SQL_init")
+sql_manip = importlib.import_module("03_SQLManip")
+
+
+def test_normalize_sql_keeps_quoted_text():
+    assert sql_manip.normalize_sql("SELECT  name\n FROM Products ;") == "SELECT name FROM Products"
+    assert sql_manip.normalize_sql("SELECT 'a  b'") != sql_manip.normalize_sql("SELECT 'a b'")
+    assert sql_manip.normalize_sql("SELECT 'it''s  here' AS \"a  b\"") == "SELECT 'it''s  here' AS \"a  b\""
+
+
+def test_cache_serves_the_query_results(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    statements = sql_manip.NamedQueries(con)
+    cache = sql_manip.QueryCache()
+    for _ in range(2):
+        for name in sql_manip.REPORTS:
+            assert sql_manip.run_report(statements, name, cache=cache) == sql_manip.run_report(statements, name)
+    assert cache.stats()["hits"] == cache.stats()["misses"] == len(sql_manip.REPORTS)
+
+    # Different literals are different queries
+    assert cache.execute(con, "SELECT 'a  b' AS text")["text"][0].as_py() == "a  b"
+    assert cache.execute(con, "SELECT 'a b' AS text")["text"][0].as_py() == "a b"
+    con.close()
+
+
+def test_cache_is_invalidated_by_optimize_layout(writable_shop_db):
+    cache = sql_manip.QueryCache()
+    con = duckdb.connect(writable_shop_db)
+    cache.execute(con, sql_manip.QUERIES["category_sales"])
+    con.close()
+
+    sql_init.optimize_layout(writable_shop_db)
+    con = duckdb.connect(writable_shop_db)
+    cache.execute(con, sql_manip.QUERIES["category_sales"])
+    con.close()
+    assert cache.stats()["invalidations"] == 1
+
+
+@pytest.fixture
+def statements(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    yield sql_manip.NamedQueries(con)
+    con.close()
+
+
+def test_batched_daily_sales_match_the_individual_lookups(statements):
+    days = ["2024-10-22", "2024-12-11", "2024-01-01", "2024-10-22"]
+    batched = sql_manip.daily_sales_batch(statements, days).to_pylist()
+    for day in sorted(set(days)):
+        individual = sql_manip.daily_sales(statements, day).to_pylist()
+        assert [row for row in batched if row["date"].isoformat() == day] == individual
+    assert sql_manip.daily_sales(statements, "2024-10-22").num_rows > 0
+
+
+def test_batched_product_sales_match_the_individual_lookups(statements):
+    products = ["Laptop", "Desk", "Novel"]
+    batched = sql_manip.product_sales_between_batch(statements, products, "2024-08-01", "2024-12-31").to_pylist()
+    individual = [row for product in sorted(products)
+                  for row in sql_manip.product_sales_between(statements, product, "2024-08-01", "2024-12-31")
+                  .to_pylist()]
+    assert batched == individual
+
+
+def test_parameters_are_bound_not_spliced(statements):
+    assert sql_manip.product_sales_between(statements, "Laptop' OR '1'='1", "2024-01-01", "2024-12-31").num_rows == 0
+    assert statements.con.execute("SELECT $value AS value", {"value": float("inf")}).fetchall() == [(float("inf"),)]
+
+
+def test_generate_load_reports_the_queries_run(shop_db, capsys):
+    con = duckdb.connect(shop_db, read_only=True)
+    load = sql_manip.generate_load(con, 2, 0.2)
+    assert load["queries"] > 0 and load["p50"] <= load["p99"]
+
+    load = sql_manip.generate_load(con, 1, 0.0)
+    con.close()
+    assert load["queries"] == 0 and load["qps"] == 0 and load["p50"] is None
+    sql_manip.print_load(1, load)
+    assert "no query finished" in capsys.readouterr().out
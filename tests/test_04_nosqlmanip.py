@@ -0,0 +1,270 @@
+import copy
+import multiprocessing
+import importlib
+import duckdb
+import pytest
+from tinydb import TinyDB
+
+nosql_init = importlib.import_module("02_NoSQL_init")
+nosql_manip = importlib.import_module("04_NoSQLManip")
+
+
+def run_analyses(db) -> list:
+    """Results of every NoSQL analysis on a store, on days and months of the seeded shop that have sales."""
+    return [
+        nosql_manip.get_total_sales_by_category(db, quiet=True),
+        nosql_manip.get_total_price_by_product(db, quiet=True),
+        nosql_manip.get_sales_by_date(db, '2024-10-22', quiet=True),
+        nosql_manip.get_sales_by_date(db, '2024-12-11', quiet=True),
+        nosql_manip.get_product_sales_by_month(db, 'Laptop', 2024, 10, quiet=True),
+        nosql_manip.get_product_sales_by_month(db, 'Desk', 2024, 8, quiet=True),
+        nosql_manip.get_sales_in_range(db, '2024-10-20', '2024-11-02', quiet=True),
+        nosql_manip.get_hierarchical_sales_summary(db, quiet=True),
+    ]
+
+
+@pytest.fixture(scope="module")
+def hierarchical_document(shop_db) -> dict:
+    con = duckdb.connect(shop_db, read_only=True)
+    document = nosql_init.convert_to_hierarchical_json(con)
+    con.close()
+    return document
+
+
+@pytest.fixture
+def tinydb_store(hierarchical_document, tmp_path):
+    db = TinyDB(str(tmp_path / "hierarchical_tinydb_shop.json"))
+    db.insert(hierarchical_document)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def expected(tinydb_store) -> list:
+    """Analyses on the plain TinyDB document, the reference for the other stores and paths."""
+    return run_analyses(tinydb_store)
+
+
+def test_ndjson_store_gives_the_same_results(shop_db, tmp_path, expected):
+    path = str(tmp_path / "hierarchical_shop.ndjson")
+    con = duckdb.connect(shop_db, read_only=True)
+    nosql_init.export_hierarchical_ndjson(con, path)
+    con.close()
+    assert run_analyses(nosql_manip.NDJSONStore(path)) == expected
+
+
+@pytest.fixture
+def snapshot_cache():
+    """Turn the snapshot cache on for one test."""
+    nosql_manip.set_snapshot_cache(True)
+    yield
+    nosql_manip.set_snapshot_cache(False)
+
+
+def test_snapshot_cache_is_off_by_default():
+    assert nosql_manip.snapshot_cache_enabled is False
+
+
+def test_snapshot_cache_gives_the_same_results_and_sees_writes(tinydb_store, expected, snapshot_cache):
+    assert run_analyses(tinydb_store) == expected
+
+    # The cached snapshot is replaced after a write, as re-reading the store would show
+    nosql_manip.add_sale(tinydb_store, 'Electronics', 'Laptop', 9999, '2024-08-10', 3)
+    cached = run_analyses(tinydb_store)
+    nosql_manip.set_snapshot_cache(False)
+    assert cached == run_analyses(tinydb_store) != expected
+
+
+def results_after_write(db) -> list:
+    """Analyses after adding a sale, then the same analyses without indexes or columnar view."""
+    nosql_manip.add_sale(db, 'Furniture', 'Desk', 9999, '2024-12-31', 2)
+    results = run_analyses(db)
+    nosql_manip._indexes.pop(db, None)
+    nosql_manip.disable_columnar(db)
+    return results, run_analyses(db)
+
+
+def test_indexes_give_the_same_results(tinydb_store, expected):
+    nosql_manip.enable_indexes(tinydb_store)
+    assert run_analyses(tinydb_store) == expected
+
+    indexed, plain = results_after_write(tinydb_store)
+    assert indexed == plain != expected
+
+
+def test_rollups_give_the_same_results_and_follow_writes(hierarchical_document, tmp_path, expected):
+    db = TinyDB(str(tmp_path / "rollups.json"))
+    db.insert(nosql_init.add_rollups(copy.deepcopy(hierarchical_document)))
+    assert run_analyses(db) == expected
+
+    nosql_manip.add_sale(db, 'Furniture', 'Desk', 9999, '2024-12-31', 2)
+    nosql_manip.add_sale(db, 'Books', 'Novel', 9998, '2025-01-01', 4)
+    nosql_manip.remove_sale(db, 'Electronics', 'Laptop', 1)
+    document = db.all()[0]
+    recomputed = nosql_init.add_rollups(copy.deepcopy({'Categories': document['Categories']}))
+    # Prices are whole numbers, so the revenues are exact
+    assert document['CategoryTotals'] == recomputed['CategoryTotals']
+    for category_name, products in document['Categories'].items():
+        for product_name, product_data in products.items():
+            assert product_data['totals'] == recomputed['Categories'][category_name][product_name]['totals']
+    db.close()
+
+
+def count_reads(monkeypatch, db) -> list:
+    """List that gets one item per read of the TinyDB storage."""
+    reads = []
+    read = db.storage.read
+    monkeypatch.setattr(db.storage, "read", lambda: reads.append(1) or read())
+    return reads
+
+
+def test_columnar_category_totals_do_not_read_the_store(tinydb_store, expected, monkeypatch):
+    nosql_manip.enable_columnar(tinydb_store)
+    reads = count_reads(monkeypatch, tinydb_store)
+    assert nosql_manip.get_total_sales_by_category(tinydb_store, quiet=True) == expected[0]
+    assert reads == []
+    nosql_manip.disable_columnar(tinydb_store)
+
+
+def test_category_totals_read_the_store_once(tinydb_store, hierarchical_document, tmp_path, expected, monkeypatch):
+    reads = count_reads(monkeypatch, tinydb_store)
+    assert nosql_manip.get_total_sales_by_category(tinydb_store, quiet=True) == expected[0]
+    assert len(reads) == 1
+
+    db = TinyDB(str(tmp_path / "rollups.json"))
+    db.insert(nosql_init.add_rollups(copy.deepcopy(hierarchical_document)))
+    reads = count_reads(monkeypatch, db)
+    assert nosql_manip.get_total_sales_by_category(db, quiet=True) == expected[0]
+    assert len(reads) == 1
+    db.close()
+
+
+def test_columnar_view_gives_the_same_results(tinydb_store, expected):
+    nosql_manip.enable_columnar(tinydb_store)
+    assert run_analyses(tinydb_store) == expected
+
+    columnar, plain = results_after_write(tinydb_store)
+    assert columnar == plain != expected
+
+
+def test_analyses_match_the_sql_queries(shop_db, tinydb_store):
+    sql_manip = importlib.import_module("03_SQLManip")
+    con = duckdb.connect(shop_db, read_only=True)
+
+    def sql_rows(name: str, **params) -> list:
+        return con.execute(sql_manip.QUERIES[name], params).fetchall()
+
+    assert nosql_manip.get_total_sales_by_category(tinydb_store, quiet=True) == {
+        category: quantity for quantity, category in sql_rows("category_sales")
+    }
+    assert sorted(tuple(product.values()) for product in
+                  nosql_manip.get_total_price_by_product(tinydb_store, quiet=True)) == sorted(sql_rows("product_prices"))
+    assert sorted((sale['category'], sale['product'], sale['quantity'], sale['date']) for sale in
+                  nosql_manip.get_sales_by_date(tinydb_store, '2024-10-22', quiet=True)) == sorted(
+        (category, name, quantity, sale_date.isoformat())
+        for category, name, unit_price, quantity, total_price, sale_date in sql_rows("daily_sales", date="2024-10-22"))
+    assert sorted((sale['date'], sale['quantity']) for sale in
+                  nosql_manip.get_product_sales_by_month(tinydb_store, 'Laptop', 2024, 10, quiet=True)) == sorted(
+        (sale_date.isoformat(), quantity) for name, unit_price, quantity, total_price, sale_date
+        in sql_rows("product_monthly", product="Laptop", first_day="2024-10-01", last_day="2024-10-31"))
+    summary = nosql_manip.get_hierarchical_sales_summary(tinydb_store, quiet=True)
+    assert sorted(list(summary['categories'].items()) + summary['products']) == sorted(sql_rows("union_summary"))
+    con.close()
+
+
+def test_shared_store_gives_the_same_results_and_persists_its_generation(tinydb_store, tmp_path, expected):
+    path = tinydb_store.storage._handle.name
+    tinydb_store.close()
+    store = nosql_manip.SharedStore(path)
+    assert run_analyses(store) == expected
+    assert store.generation == 1
+
+    store.write(nosql_manip.add_sale, 'Furniture', 'Desk', 9999, '2024-12-31', 2)
+    assert store.generation == 2
+    assert not list(tmp_path.glob("*.tmp"))
+    db = TinyDB(path)
+    assert run_analyses(store) == run_analyses(db) != expected
+    db.close()
+
+    # A new store on the same file carries on from the generation of the last write
+    store = nosql_manip.SharedStore(path)
+    assert store.generation == 2
+    desk_sales = next(data for _, name, data in store.current().products if name == 'Desk')['sales']
+    store.write(nosql_manip.remove_sale, 'Furniture', 'Desk', len(desk_sales))
+    assert nosql_manip.SharedStore(path).generation == 3
+    assert run_analyses(store) == expected
+
+
+def scanned_sales(document: dict, start_date: str, end_date: str) -> list:
+    """(date, category, product, quantity) of the sales between two dates, by comparing every date string."""
+    return sorted(
+        (sale['date'], category_name, product_name, sale['quantity'])
+        for category_name, products in document['Categories'].items()
+        for product_name, product_data in products.items()
+        for sale in product_data['sales'].values()
+        if start_date <= sale['date'] <= end_date
+    )
+
+
+@pytest.mark.parametrize("start_date, end_date", [
+    ('2024-10-20', '2024-11-02'), ('2024-01-01', '2024-12-31'), ('2024-10-22', '2024-10-22'),
+    ('2023-12-01', '2024-01-15'), ('2024-06-01', '2024-05-01'), ('2025-01-01', '2025-12-31'),
+])
+def test_range_scans_match_a_full_scan(tinydb_store, start_date, end_date):
+    # A back-dated sale, inserted in date order
+    nosql_manip.add_sale(tinydb_store, 'Furniture', 'Desk', 9999, '2024-01-01', 2)
+    document = tinydb_store.all()[0]
+    expected = scanned_sales(document, start_date, end_date)
+
+    assert sorted((sale['date'], sale['category'], sale['product'], sale['quantity']) for sale in
+                  nosql_manip.get_sales_in_range(tinydb_store, start_date, end_date, quiet=True)) == expected
+    if start_date == end_date:
+        assert sorted((sale['date'], sale['category'], sale['product'], sale['quantity']) for sale in
+                      nosql_manip.get_sales_by_date(tinydb_store, start_date, quiet=True)) == expected
+
+
+@pytest.mark.parametrize("month", range(1, 13))
+def test_monthly_range_scans_match_a_full_scan(tinydb_store, month):
+    nosql_manip.add_sale(tinydb_store, 'Furniture', 'Desk', 9999, '2024-01-01', 2)
+    expected = [sale for sale in scanned_sales(tinydb_store.all()[0], f'2024-{month:02d}-01', f'2024-{month:02d}-31')
+                if sale[2] == 'Desk']
+    assert sorted((sale['date'], 'Furniture', 'Desk', sale['quantity']) for sale in
+                  nosql_manip.get_product_sales_by_month(tinydb_store, 'Desk', 2024, month, quiet=True)) == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_partitioned_store_gives_the_same_results(hierarchical_document, tmp_path, expected, workers):
+    nosql_init.write_hierarchical_partitions(hierarchical_document, str(tmp_path / "partitions"))
+    store = nosql_manip.PartitionedStore(str(tmp_path / "partitions"), workers)
+    assert run_analyses(store) == expected
+    # The process pool of the first aggregation is reused by the next ones
+    executor = store.executor
+    assert run_analyses(store) == expected
+    assert store.executor is executor and (executor is None) == (workers == 1)
+    store.close()
+    assert store.executor is None
+
+
+def add_desk_sales(path: str, count: int):
+    store = nosql_manip.SharedStore(path)
+    for ticket in range(count):
+        store.write(nosql_manip.add_sale, 'Furniture', 'Desk', 10000 + ticket, '2024-12-31', 1)
+
+
+def test_shared_store_serializes_writers_of_several_processes(tinydb_store, tmp_path):
+    path = tinydb_store.storage._handle.name
+    desk_sales = len(tinydb_store.all()[0]['Categories']['Furniture']['Desk']['sales'])
+    tinydb_store.close()
+
+    writers = [multiprocessing.Process(target=add_desk_sales, args=(path, 15)) for _ in range(2)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert [writer.exitcode for writer in writers] == [0, 0]
+
+    store = nosql_manip.SharedStore(path)
+    products = {product_name: product_data for _, product_name, product_data in store.current().products}
+    assert len(products['Desk']['sales']) == desk_sales + 30
+    assert store.generation >= 30
+    assert not list(tmp_path.glob("*.tmp"))
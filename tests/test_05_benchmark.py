@@ -0,0 +1,76 @@
+import importlib
+import duckdb
+import pytest
+
+benchmark = importlib.import_module("05_Benchmark")
+
+
+@pytest.fixture
+def con(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    yield con
+    con.close()
+
+
+def test_fetch_modes_materialize_every_row(con):
+    for query in benchmark.SQL_QUERIES.values():
+        rows = con.execute(query).fetchall()
+        assert len(benchmark.FETCH_MODES["fetchdf"](con.execute(query))) == len(rows)
+        table = benchmark.FETCH_MODES["arrow"](con.execute(query))
+        assert table.to_pylist() == [dict(zip(table.column_names, row)) for row in rows]
+        numpy_columns = benchmark.FETCH_MODES["fetchnumpy"](con.execute(query))
+        assert all(len(column) == len(rows) for column in numpy_columns.values())
+
+
+def test_repeat_operation_follows_settings():
+    calls = []
+    settings = benchmark.RunSettings(num_runs=3, warmup_runs=2)
+    times = benchmark.repeat_operation(calls.append, None, settings=settings)
+    assert len(times) == 3 and len(calls) == 5
+
+    calls.clear()
+    settings = benchmark.RunSettings(num_runs=2, warmup_runs=0, stable_rel_error=0.0, max_runs=6)
+    times = benchmark.repeat_operation(calls.append, None, settings=settings)
+    assert len(times) == len(calls) <= 6
+
+
+def test_write_results_without_records(tmp_path):
+    csv_path = tmp_path / "results.csv"
+    benchmark.write_results([], str(csv_path), {})
+    assert csv_path.read_text().strip().split(",") == benchmark.RECORD_FIELDS
+
+    json_path = tmp_path / "results.json"
+    benchmark.write_results([], str(json_path), {"runs": 1})
+    assert json_path.read_text()
+
+
+@pytest.fixture
+def tinydb_path(con, tmp_path) -> str:
+    nosql_init = importlib.import_module("02_NoSQL_init")
+    path = str(tmp_path / "hierarchical_tinydb_shop.json")
+    db = nosql_init.open_tinydb(path)
+    db.insert(nosql_init.convert_to_hierarchical_json(con))
+    db.close()
+    return path
+
+
+def test_cold_start_phases_add_up(shop_db, tinydb_path):
+    phases = benchmark.cold_start_phases(shop_db, tinydb_path)
+    assert list(phases["SQL"]) == ["open", "first query", "close", "total"]
+    assert list(phases["NoSQL"]) == ["open", "load", "first query", "close", "total"]
+    for engine_phases in phases.values():
+        assert engine_phases["total"] == pytest.approx(sum(engine_phases.values()) - engine_phases["total"])
+    # The snapshot cache is only turned on for the cold start
+    assert importlib.import_module("04_NoSQLManip").snapshot_cache_enabled is False
+
+
+def test_cold_starts_in_a_fresh_process(shop_db, tinydb_path):
+    stats = benchmark.time_cold_starts(shop_db, tinydb_path, "json", 2, fresh_process=True)
+    assert stats["NoSQL"]["size"] == benchmark.os.path.getsize(tinydb_path)
+    assert stats["NoSQL"]["load"]["runs"] == stats["SQL"]["total"]["runs"] == 2
+
+
+def test_relational_conversion_run_measures_both_engines(shop_db):
+    for engine in ("pandas", "arrow"):
+        run = benchmark.relational_conversion_run(shop_db, engine)
+        assert run["seconds"] > 0 and run["peak_memory"] > 0
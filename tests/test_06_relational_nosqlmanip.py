@@ -0,0 +1,49 @@
+import importlib
+import duckdb
+import pytest
+from tinydb import TinyDB
+
+nosql_init = importlib.import_module("02_NoSQL_init")
+nosql_manip = importlib.import_module("04_NoSQLManip")
+relational_manip = importlib.import_module("06_RelationalNoSQLManip")
+
+
+def run_analyses(module, db) -> list:
+    """Results of the five analyses of a module, on days and months of the seeded shop that have sales."""
+    return [
+        module.get_total_sales_by_category(db, quiet=True),
+        module.get_total_price_by_product(db, quiet=True),
+        module.get_sales_by_date(db, '2024-10-22', quiet=True),
+        module.get_product_sales_by_month(db, 'Laptop', 2024, 10, quiet=True),
+        module.get_hierarchical_sales_summary(db, quiet=True),
+    ]
+
+
+@pytest.fixture(scope="module")
+def con(shop_db):
+    con = duckdb.connect(shop_db, read_only=True)
+    yield con
+    con.close()
+
+
+@pytest.fixture(scope="module")
+def expected(con, tmp_path_factory) -> list:
+    """Analyses of 04_NoSQLManip on the hierarchical store."""
+    db = TinyDB(str(tmp_path_factory.mktemp("hierarchical") / "hierarchical_tinydb_shop.json"))
+    db.insert(nosql_init.convert_to_hierarchical_json(con))
+    results = run_analyses(nosql_manip, db)
+    db.close()
+    return results
+
+
+def test_hash_joins_on_the_relational_store_match_the_hierarchical_store(con, tmp_path, expected):
+    path = str(tmp_path / "relational_tinydb_shop.json")
+    nosql_init.write_relational_tinydb(nosql_init.convert_to_relational_json(con), path)
+    db = nosql_init.open_tinydb(path)
+    assert run_analyses(relational_manip, db) == expected
+    db.close()
+
+
+def test_hash_joins_on_arrow_tables_match_the_hierarchical_store(con, tmp_path, expected):
+    nosql_init.export_relational_arrow(con, str(tmp_path))
+    assert run_analyses(relational_manip, nosql_init.read_relational_arrow(str(tmp_path))) == expected